@@ -11,14 +11,63 @@ __author__ = 'Micah Cearns'
 __contact__ = 'micahcearns@gmail.com'
 __date__ = 'August 2020'
 
-import requests
-import pandas as pd
+import argparse
+import json
 import os
+import shutil
+import time
+import pandas as pd
+from functools import partial
+from itertools import islice
 from tqdm import tqdm
 
+from api_utils import (ENDPOINT_TTL, FAPI_BASE_URL, AdaptiveConcurrency,
+                       BudgetExhaustedError, RateLimitedSession, RateLimiter,
+                       RequestBudget, get_json, iter_json, make_session,
+                       ordered_map, shared_cache)
+from metrics import shared_metrics
+from storage import (append_partition, compact_dtypes, conform_parts,
+                     dataset_path, memory_report, partition_schema,
+                     replace_partition, staging_path, sum_memory_reports,
+                     write_dataset, write_part)
+
 OUTPUT_PATH = ('/Users/MicahJackson/anaconda/Pycharm_WD/Draft_Kings_EPL_Project'
                '/Output')
 
+# Match these to the RapidAPI plan the key belongs to
+FAPI_MAX_WORKERS = 8
+FAPI_REQUESTS_PER_MINUTE = 450
+FAPI_DAILY_REQUESTS = 7500  # None for no daily budget
+FAPI_BUDGET_RESERVE = 10  # Requests kept back for retries when planning
+PLAYER_BATCH_SIZE = 5000  # Player records normalised and written at a time
+
+PLAYER_FIXTURE_DATASET = 'player_fixture'  # Partitioned by league and season
+PLAYER_SEASON_DATASET = 'player_season'  # Season totals, from --team-season
+WATERMARK_FILE = '_watermark.json'  # Fixtures already ingested, per partition
+FINISHED_STATUSES = ['FT', 'AET', 'PEN']  # Fixtures whose stats are final
+# Fixtures that will never be played: cancelled, abandoned, awarded, walked
+# over, or postponed and never rescheduled once the season is over
+UNPLAYED_STATUSES = ['CANC', 'ABD', 'AWD', 'WO', 'PST']
+FIXTURE_FIELDS = ['fixture_id', 'league_id', 'event_date', 'event_timestamp',
+                  'round', 'statusShort']  # Kept from the fixtures payload
+PLAN_FILE = '_plan.json'  # Fixtures the last run left for later, per partition
+BUDGET_FILE = '_fapi_requests.json'  # Requests sent today, in OUTPUT_PATH
+
+# Team season fields kept, as the player_fixture columns reconciliation uses
+PLAYER_SEASON_FIELDS = {'player_id': 'player_id',
+                        'player_name': 'player_name',
+                        'team_id': 'team_id',
+                        'team_name': 'team_name',
+                        'position': 'position',
+                        'games.appearences': 'appearances',
+                        'games.minutes_played': 'minutes_played',
+                        'goals.total': 'goals.total',
+                        'goals.assists': 'goals.assists',
+                        'goals.saves': 'goals.saves'}
+
+fapi_budget_instance = None
+fapi_rate_limiter_instance = None  # Set by backfill.py to share one limit
+
 
 def connect_to_api():
     """ Connect to the rapid football api """
@@ -29,6 +78,39 @@ def connect_to_api():
     return headers
 
 
+def fapi_budget():
+    """ Daily request budget shared by every football api request """
+    global fapi_budget_instance
+    if fapi_budget_instance is None and FAPI_DAILY_REQUESTS is not None:
+        fapi_budget_instance = RequestBudget(
+            FAPI_DAILY_REQUESTS, os.path.join(OUTPUT_PATH, BUDGET_FILE)
+        )
+    return fapi_budget_instance
+
+
+def fapi_session(headers,
+                 max_workers=1,
+                 requests_per_minute=FAPI_REQUESTS_PER_MINUTE):
+    """
+
+    Session for the football api, counted against the daily budget
+
+    :param headers: API headers
+    :param max_workers: Number of threads sharing the session
+    :param requests_per_minute: Client-side rate limit for the API
+
+    :return session: RateLimitedSession to pass to get_json
+    """
+    rate_limiter = fapi_rate_limiter_instance
+    if rate_limiter is None:
+        rate_limiter = RateLimiter(requests_per_minute / 60, burst=max_workers)
+    # Concurrency backs off below max_workers while the api sends 429s
+    return RateLimitedSession(make_session(headers, pool_size=max_workers),
+                              rate_limiter,
+                              AdaptiveConcurrency(max_workers),
+                              budget=fapi_budget())
+
+
 def get_league_id(headers,
                   league='Premier League',
                   country='England',
@@ -44,19 +126,98 @@ def get_league_id(headers,
 
     :return league_id: Integer value representing the league id
     """
-    league_url = 'https://api-football-v1.p.rapidapi.com/v2/leagues'
-    response_league = requests.request("GET", league_url, headers=headers)
-    league_df = pd.json_normalize(response_league.json()['api']['leagues'])
-    epl_df = (league_df
-              .loc[(league_df['name'] == league)
-                   & (league_df['country'] == country)]
-              .sort_values(by='season'))
-    epl_df.to_csv(os.path.join(OUTPUT_PATH, 'EPL_df.csv'))
+    league_url = FAPI_BASE_URL + '/leagues'
+    # Every league in the world is listed, only this one's seasons are kept
+    leagues = [item for _, item in iter_json(fapi_session(headers),
+                                             league_url,
+                                             ('api',),
+                                             {'leagues'})
+               if item['name'] == league and item['country'] == country]
+    epl_df = pd.json_normalize(leagues).sort_values(by='season')
+    write_dataset(epl_df, OUTPUT_PATH, 'leagues')
     league_id = (epl_df.loc[epl_df['season'] == year]['league_id'].iloc[0])
 
     return league_id
 
 
+def get_league_ids(headers, league_seasons):
+    """
+
+    Get the league ids of many league seasons from one leagues response
+
+    :param headers: API headers
+    :param league_seasons: Iterable of (league, country, season) tuples
+
+    :return league_ids: Dictionary of (league, country, season) to league id
+    """
+    league_url = FAPI_BASE_URL + '/leagues'
+    league_seasons = list(league_seasons)
+    wanted = set(league_seasons)
+    league_ids = {}
+    for _, league in iter_json(fapi_session(headers),
+                               league_url,
+                               ('api',),
+                               {'leagues'}):
+        key = (league['name'], league['country'], league['season'])
+        if key in wanted:
+            league_ids[key] = league['league_id']
+
+    missing = [key for key in league_seasons if key not in league_ids]
+    if missing:
+        raise ValueError('Unknown league seasons: {}'.format(missing))
+    return {key: league_ids[key] for key in league_seasons}
+
+
+def get_fixtures(league_id, headers):
+    """
+
+    Get the fixtures within a league and season
+
+    :param league_id: League id value as an integer
+    :param headers: API headers
+
+    :return fixture_df: Pandas dataframe of the FIXTURE_FIELDS of every
+                        fixture, fixture_id as a string
+    """
+    epl_url = FAPI_BASE_URL + '/fixtures/league/' + str(league_id)
+    with shared_metrics().stage('fixtures') as stage:
+        fixtures = iter_json(fapi_session(headers),
+                             epl_url,
+                             ('api',),
+                             {'fixtures'})
+        fixture_df = pd.DataFrame.from_records(
+            ([fixture.get(field) for field in FIXTURE_FIELDS]
+             for _, fixture in fixtures),
+            columns=FIXTURE_FIELDS
+        )
+        fixture_df['fixture_id'] = fixture_df['fixture_id'].astype(str)
+        stage.rows = len(fixture_df)
+
+    return fixture_df
+
+
+def plan_fixtures(fixture_df, now=None):
+    """
+
+    Fixtures worth spending requests on, most recent first
+
+    Only finished fixtures that have kicked off are kept. Unplayed, postponed,
+    cancelled and in-play fixtures have no final player stats, so fetching
+    them would waste requests. The latest fixtures come first, so a run cut
+    short by the request budget still picks up the freshest data.
+
+    :param fixture_df: Fixtures from get_fixtures
+    :param now: Unix time to plan at, defaults to the current time
+
+    :return plan_df: The fixtures to fetch, in priority order
+    """
+    now = time.time() if now is None else now
+    return (fixture_df
+            .loc[fixture_df['statusShort'].isin(FINISHED_STATUSES)
+                 & (fixture_df['event_timestamp'] <= now)]
+            .sort_values(by='event_timestamp', ascending=False, kind='stable'))
+
+
 def get_fixture_ids(league_id, headers):
     """
 
@@ -65,51 +226,510 @@ def get_fixture_ids(league_id, headers):
     :param league_id: League id value as an integer
     :param headers: API headers
 
-    :return fixture_ids: Integer ids for each fixture within season
+    :return fixture_ids: Ids of the fixtures with player stats, most recent
+                         first, see plan_fixtures
     """
-    epl_url = ('https://api-football-v1.p.rapidapi.com/v2/fixtures/league/'
-               + league_id.astype(str))
-    response_epl = requests.request('GET', epl_url, headers=headers)
-    epl_fixture_id_df = pd.json_normalize(response_epl.json()['api']['fixtures'])
-    fixture_ids = epl_fixture_id_df['fixture_id'].astype(str).tolist()
+    fixture_ids = plan_fixtures(get_fixtures(league_id, headers))
+    fixture_ids = fixture_ids['fixture_id'].tolist()
 
     return fixture_ids
 
 
-def get_player_data(fixture_ids, headers):
+def fixture_players_url(fixture_id):
+    """ Url of the player stats of a fixture """
+    return FAPI_BASE_URL + '/players/fixture/' + fixture_id
+
+
+def budget_fixtures(fixture_ids,
+                    budget,
+                    reserve=FAPI_BUDGET_RESERVE,
+                    cache=None):
+    """
+
+    Split planned fixtures into those today's request budget covers and the
+    rest
+
+    Fixtures with a fresh cached response cost nothing, so a run picking up
+    after one cut short by the budget only spends requests on new fixtures.
+
+    :param fixture_ids: Fixture ids in priority order
+    :param budget: RequestBudget, None for no budget
+    :param reserve: Requests kept back for retries
+    :param cache: ResponseCache the fixtures are fetched through, defaults to
+                  shared_cache()
+
+    :return fetch_ids: Fixture ids to fetch now, in priority order
+    :return deferred_ids: Fixture ids left for a later run
+    """
+    if budget is None:
+        return list(fixture_ids), []
+    cache = cache if cache is not None else shared_cache()
+    remaining = budget.remaining() - reserve
+    fetch_ids, deferred_ids = [], []
+    for fixture_id in fixture_ids:
+        if cache.contains(fixture_players_url(fixture_id)):
+            fetch_ids.append(fixture_id)
+        elif remaining > 0:
+            fetch_ids.append(fixture_id)
+            remaining -= 1
+        else:
+            deferred_ids.append(fixture_id)
+    return fetch_ids, deferred_ids
+
+
+def save_plan(path, fetch_ids, deferred_ids):
+    """
+
+    Record which planned fixtures were fetched and which were left for later
+
+    :param path: League/season partition directory
+    :param fetch_ids: Fixture ids fetched by this run
+    :param deferred_ids: Fixture ids the request budget did not cover
+    """
+    plan = {'planned_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'fetched': len(fetch_ids),
+            'deferred': deferred_ids}
+    os.makedirs(path, exist_ok=True)
+    save_json(plan, os.path.join(path, PLAN_FILE))
+    if deferred_ids:
+        print('{} fixtures left for a later run, the daily request budget is '
+              'used up'.format(len(deferred_ids)))
+
+
+def fetch_fixture_players(fixture_id, session, ttl=ENDPOINT_TTL):
+    """
+
+    Fetch the player payload for a single fixture
+
+    Cached responses are served without touching the rate limiter. Failed
+    requests are retried by get_json and raise once retries run out, so a
+    fixture is never silently skipped.
+
+    :param fixture_id: Fixture id as a string
+    :param session: Session from fapi_session shared by all worker threads
+    :param ttl: Seconds the cached response stays fresh, None once the
+                fixture has finished
+
+    :return payload: Decoded API response for the fixture
+    """
+    return get_json(session, fixture_players_url(fixture_id), ttl=ttl)
+
+
+def fetch_player_payloads(fixture_ids,
+                          headers,
+                          max_workers=FAPI_MAX_WORKERS,
+                          requests_per_minute=FAPI_REQUESTS_PER_MINUTE,
+                          ttl=ENDPOINT_TTL):
+    """
+
+    Fetch fixture player payloads concurrently, in fixture_ids order
+
+    :param fixture_ids: Fixture ids as strings
+    :param headers: API headers
+    :param max_workers: Number of fixtures fetched at the same time
+    :param requests_per_minute: Client-side rate limit for the API
+    :param ttl: Seconds cached responses stay fresh
+
+    :return payloads: Generator of decoded API responses
+    """
+    session = fapi_session(headers,
+                           max_workers=max_workers,
+                           requests_per_minute=requests_per_minute)
+    fetch = partial(fetch_fixture_players, session=session, ttl=ttl)
+    return tqdm(ordered_map(fetch, fixture_ids, max_workers=max_workers),
+                total=len(fixture_ids),
+                desc='Getting player data')
+
+
+def until_budget_exhausted(payloads, fixture_ids, unfetched_ids):
+    """
+
+    Pass payloads through until the request budget runs out mid-fetch
+
+    Retries can spend more requests than budget_fixtures keeps in reserve.
+    Rather than the run failing, the fixture that ran out of budget and every
+    one after it are added to unfetched_ids, to be deferred to a later run.
+
+    :param payloads: Payloads of fixture_ids, in order
+    :param fixture_ids: List of the fixture ids being fetched
+    :param unfetched_ids: List the ids not fetched are added to
+
+    :return payloads: Generator of the payloads fetched within the budget
+    """
+    fetched = 0
+    try:
+        for payload in payloads:
+            yield payload
+            fetched += 1
+    except BudgetExhaustedError:
+        unfetched_ids.extend(fixture_ids[fetched:])
+
+
+def iter_fixture_players(payloads):
+    """
+
+    Stream player records out of fixture payloads
+
+    Fixtures without a players list (e.g. not yet played) are skipped.
+
+    :param payloads: Iterable of decoded fixture player API responses
+
+    :return players: Generator of player dictionaries, one per player per
+                     fixture
+    """
+    for payload in payloads:
+        players = payload['api'].get('players', [])
+        yield from players
+
+
+def batch_records(records, batch_size):
+    """
+
+    Group an iterable of records into lists of at most batch_size
+
+    :param records: Iterable of records
+    :param batch_size: Maximum number of records per batch
+
+    :return batches: Generator of record lists
+    """
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_player_batches(players,
+                         path,
+                         batch_size=PLAYER_BATCH_SIZE,
+                         append=False):
+    """
+
+    Normalise player records in fixed-size batches and write them to Parquet
+
+    Only one batch is held in memory at a time and each batch becomes one
+    compressed part file, with compact dtypes applied. The memory they save
+    over the normalised records, summed over the batches, is printed. The
+    parts are then conformed to one schema holding every column seen in any
+    batch (and in the existing partition when appending), since a stat can
+    first appear in a later batch and each batch's columns are downcast to
+    fit just its own values. Parts are staged in a separate directory first,
+    so the partition is left untouched if fetching fails part way through.
+
+    :param players: Iterable of player dictionaries
+    :param path: League/season partition directory to write
+    :param batch_size: Number of players normalised per batch
+    :param append: Add the rows to the existing partition instead of
+                   replacing it
+
+    :return n_rows: Number of player rows written
+    """
+    staging = staging_path(path)
+    shutil.rmtree(staging, ignore_errors=True)
+
+    append = append and os.path.exists(path)
+    n_rows = 0
+    memory_reports = []
+    for batch in batch_records(players, batch_size):
+        raw_df = pd.json_normalize(batch)
+        batch_df = compact_dtypes(raw_df, PLAYER_FIXTURE_DATASET)
+        memory_reports.append(memory_report(raw_df, batch_df))
+        write_part(batch_df, staging, PLAYER_FIXTURE_DATASET)
+        n_rows += len(batch_df)
+
+    if not n_rows:
+        return n_rows
+    print(sum_memory_reports(memory_reports))
+    if append:
+        conform_parts(staging, partition_schema(path))
+        append_partition(staging, path)
+        conform_parts(path)  # Widens older parts if the new rows needed it
+    else:
+        conform_parts(staging)
+        replace_partition(staging, path)
+    return n_rows
+
+
+def get_player_data(fixture_ids,
+                    headers,
+                    league='England Premier League',
+                    season=2020,
+                    max_workers=FAPI_MAX_WORKERS,
+                    requests_per_minute=FAPI_REQUESTS_PER_MINUTE,
+                    batch_size=PLAYER_BATCH_SIZE):
     """
 
     Get individual player data by fixture within league season
 
-    :param fixture_ids: Integer fixture ids value for fixtures in season
+    Fixtures are fetched concurrently over one pooled session, throttled to
+    the RapidAPI plan's rate limit. Results are still processed in fixture_ids
+    order so the output is deterministic. Players are streamed to disk in
+    batches rather than collected into one list, so memory stays bounded
+    however many fixtures are ingested.
+
+    Only the fixtures today's request budget covers are fetched, the rest are
+    recorded in the partition's plan file, as are any the budget runs out
+    before (e.g. when retries spend more than the reserve). Their responses
+    are cached for good, so rerunning on a later day fetches just the
+    fixtures left over.
+
+    :param fixture_ids: Ids of finished fixtures in season, in priority order
+                        (see get_fixture_ids)
     :param headers: API headers
+    :param league: League the fixtures belong to, used as the partition
+    :param season: Season the fixtures belong to, used as the partition
+    :param max_workers: Number of fixtures fetched at the same time
+    :param requests_per_minute: Client-side rate limit for the API
+    :param batch_size: Number of players normalised and written at a time
 
-    :return player_fixture_df: Pandas dataframe of individual players and
-                               their metrics per game within a league season
+    :return path: Partition directory of individual players and their
+                  metrics per game within a league season
     """
-    url = "https://api-football-v1.p.rapidapi.com/v2/players/fixture/"
-    player_list = []
-    for id in tqdm(fixture_ids, desc='Getting player data'):
-        response = requests.request("GET", url + id, headers=headers)
-        results_n = response.json()['api']['results']  # Getting n players
-        results_n_range = range(0, results_n, 1)
-        for n in results_n_range:  # Looping through all players in each fixture
-            try:
-                player = response.json()['api']['players'][n]
-            except KeyError:
-                pass
-            player_list.append(player)
+    fetch_ids, deferred_ids = budget_fixtures(fixture_ids, fapi_budget())
+    # Finished fixtures never change, so their responses are cached forever
+    payloads = fetch_player_payloads(fetch_ids,
+                                     headers,
+                                     max_workers=max_workers,
+                                     requests_per_minute=requests_per_minute,
+                                     ttl=None)
+
+    unfetched_ids = []
+    payloads = until_budget_exhausted(payloads, fetch_ids, unfetched_ids)
+
+    # Replacing the partition also drops its watermark, so the next sync
+    # rebuilds it rather than appending duplicates
+    path = dataset_path(OUTPUT_PATH, PLAYER_FIXTURE_DATASET, league, season)
+    with shared_metrics().stage('player_fixture') as stage:
+        stage.rows = write_player_batches(iter_fixture_players(payloads),
+                                          path,
+                                          batch_size=batch_size)
+    save_plan(path,
+              fetch_ids[:len(fetch_ids) - len(unfetched_ids)],
+              unfetched_ids + deferred_ids)
 
-    player_fixture_df = pd.json_normalize(player_list)
-    player_fixture_df.to_csv(os.path.join(OUTPUT_PATH,
-                                          'Player_fixture_df_2020.csv'))
+    return path
 
-    return player_fixture_df
+
+def get_teams(league_id, headers):
+    """
+
+    Get the teams within a league and season
+
+    :param league_id: League id value as an integer
+    :param headers: API headers
+
+    :return teams: List of team dictionaries with team_id and name
+    """
+    teams_url = FAPI_BASE_URL + '/teams/league/' + str(league_id)
+    return get_json(fapi_session(headers), teams_url)['api']['teams']
+
+
+def fetch_team_players(team_id, season, session):
+    """
+
+    Fetch every player's season statistics for one team
+
+    :param team_id: Team id as an integer
+    :param season: Season the league starts in, e.g. 2019
+    :param session: Session from fapi_session shared by all worker threads
+
+    :return players: List of player dictionaries, one per player per
+                     competition the team played in
+    """
+    url = '{}/players/team/{}/{}-{}'.format(FAPI_BASE_URL,
+                                            team_id,
+                                            season,
+                                            season + 1)
+    return get_json(session, url)['api']['players']
+
+
+def team_season_rows(players, league_id):
+    """
+
+    Keep a team's league statistics in the player_fixture column names
+
+    :param players: Player dictionaries from fetch_team_players
+    :param league_id: League whose statistics are kept, other competitions
+                      (e.g. cups) are dropped
+
+    :return player_df: Pandas dataframe of the PLAYER_SEASON_FIELDS columns
+    """
+    players = [player for player in players
+               if player['league_id'] == league_id]
+    return (pd.json_normalize(players)
+            .reindex(columns=list(PLAYER_SEASON_FIELDS))
+            .rename(columns=PLAYER_SEASON_FIELDS))
+
+
+def get_team_season_data(league_id,
+                         headers,
+                         league='England Premier League',
+                         season=2020,
+                         max_workers=FAPI_MAX_WORKERS,
+                         requests_per_minute=FAPI_REQUESTS_PER_MINUTE):
+    """
+
+    Get every player's season totals within a league season, team by team
+
+    One request per team (about 20 a season) instead of one per fixture, for
+    jobs that only need season totals. The rows carry the player_fixture
+    column names reconciliation and the aggregates use, minus event_id, and a
+    player who moved teams mid-season has one row per team.
+
+    :param league_id: League id value as an integer
+    :param headers: API headers
+    :param league: League the teams belong to, used as the partition
+    :param season: Season the league starts in, used as the partition
+    :param max_workers: Number of teams fetched at the same time
+    :param requests_per_minute: Client-side rate limit for the API
+
+    :return path: Partition directory of the player season totals
+    """
+    team_ids = [team['team_id'] for team in get_teams(league_id, headers)]
+    session = fapi_session(headers,
+                           max_workers=max_workers,
+                           requests_per_minute=requests_per_minute)
+    fetch = partial(fetch_team_players, season=season, session=session)
+    with shared_metrics().stage('player_season') as stage:
+        player_df = pd.concat(
+            [team_season_rows(players, league_id)
+             for players in tqdm(ordered_map(fetch, team_ids, max_workers),
+                                 total=len(team_ids),
+                                 desc='Getting team season data')],
+            ignore_index=True
+        )
+        player_df = compact_dtypes(player_df, PLAYER_SEASON_DATASET)
+        stage.rows = len(player_df)
+        path = write_dataset(player_df,
+                             OUTPUT_PATH,
+                             PLAYER_SEASON_DATASET,
+                             league,
+                             season)
+
+    return path
+
+
+def load_watermark(watermark_file):
+    """
+
+    Load the fixtures that have already been ingested
+
+    :param watermark_file: Path of the watermark json
+
+    :return watermark: Dictionary of fixture_id to the fixture status at the
+                       time it was ingested
+    """
+    if not os.path.exists(watermark_file):
+        return {}
+    with open(watermark_file) as f:
+        return json.load(f)
+
+
+def save_json(data, json_file):
+    """ Atomically write a json state file, e.g. the watermark """
+    tmp_file = json_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, json_file)
+
+
+def sync_player_data(league_id,
+                     headers,
+                     league='England Premier League',
+                     season=2020,
+                     max_workers=FAPI_MAX_WORKERS,
+                     requests_per_minute=FAPI_REQUESTS_PER_MINUTE,
+                     batch_size=PLAYER_BATCH_SIZE):
+    """
+
+    Incrementally add newly finished fixtures to the player fixture store
+
+    Only fixtures that have finished since the last sync are fetched. Their
+    players are appended to the league/season partition and the watermark is
+    only updated once they have been written, so an interrupted sync is simply
+    retried on the next run. Without a watermark (e.g. after a full
+    get_player_data run) the partition is rebuilt from every finished fixture.
+    Fixtures are fetched most recent first, up to today's request budget, and
+    the ones left over (including any the budget runs out before mid-fetch)
+    are picked up by the next sync.
+
+    :param league_id: League id value as an integer
+    :param headers: API headers
+    :param league: League the fixtures belong to, used as the partition
+    :param season: Season the fixtures belong to, used as the partition
+    :param max_workers: Number of fixtures fetched at the same time
+    :param requests_per_minute: Client-side rate limit for the API
+    :param batch_size: Number of players normalised and written at a time
+
+    :return path: Partition directory of the player fixture data
+    :return new_fixture_ids: Fixture ids ingested by this sync
+    """
+    path = dataset_path(OUTPUT_PATH, PLAYER_FIXTURE_DATASET, league, season)
+    watermark = load_watermark(os.path.join(path, WATERMARK_FILE))
+
+    finished_df = plan_fixtures(get_fixtures(league_id, headers))
+    finished_df = finished_df.loc[
+        ~finished_df['fixture_id'].isin(watermark.keys())
+    ]
+    new_fixture_ids, deferred_ids = budget_fixtures(
+        finished_df['fixture_id'], fapi_budget()
+    )
+    if not new_fixture_ids:
+        if deferred_ids or os.path.exists(path):
+            save_plan(path, new_fixture_ids, deferred_ids)
+        return path, new_fixture_ids
+
+    # Finished fixtures never change, so their responses are cached forever
+    payloads = fetch_player_payloads(new_fixture_ids,
+                                     headers,
+                                     max_workers=max_workers,
+                                     requests_per_minute=requests_per_minute,
+                                     ttl=None)
+    unfetched_ids = []
+    payloads = until_budget_exhausted(payloads, new_fixture_ids, unfetched_ids)
+    with shared_metrics().stage('player_fixture') as stage:
+        stage.rows = write_player_batches(iter_fixture_players(payloads),
+                                          path,
+                                          batch_size=batch_size,
+                                          append=bool(watermark))
+    new_fixture_ids = new_fixture_ids[:len(new_fixture_ids)
+                                      - len(unfetched_ids)]
+    save_plan(path, new_fixture_ids, unfetched_ids + deferred_ids)
+
+    finished_df = finished_df.loc[
+        finished_df['fixture_id'].isin(new_fixture_ids)
+    ]
+    watermark.update(zip(finished_df['fixture_id'],
+                         finished_df['statusShort']))
+    save_json(watermark, os.path.join(path, WATERMARK_FILE))
+
+    return path, new_fixture_ids
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help='Only fetch fixtures finished since the last run')
+    parser.add_argument('--team-season',
+                        action='store_true',
+                        help='Fetch season totals team by team instead of '
+                             'every fixture, for jobs that only need totals')
+    args = parser.parse_args()
+
     headers = connect_to_api()  # EPL league id is 524
-    league_id = get_league_id(headers, 'Premier League', 'England', 2020)
-    fixture_ids = get_fixture_ids(league_id, headers)
-    player_df = get_player_data(fixture_ids, headers)
-    print(player_df)
+    try:
+        league_id = get_league_id(headers, 'Premier League', 'England', 2020)
+        if args.team_season:
+            print(get_team_season_data(league_id, headers))
+        elif args.incremental:
+            player_path, new_ids = sync_player_data(league_id, headers)
+            print('{} new fixtures added to {}'.format(len(new_ids),
+                                                       player_path))
+        else:
+            fixture_ids = get_fixture_ids(league_id, headers)
+            player_path = get_player_data(fixture_ids, headers)
+            print(player_path)
+    finally:  # Slow or failed runs are the ones worth looking at
+        shared_metrics().save(OUTPUT_PATH, 'fetch_fixtures')
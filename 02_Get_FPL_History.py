@@ -11,104 +11,335 @@ __author__ = 'Micah Cearns'
 __contact__ = 'micahcearns@gmail.com'
 __date__ = 'August 2020'
 
-import json
 import os
-import time
-import warnings
+import shutil
 import pandas as pd
-import progressbar
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import partial
 from tqdm import tqdm
-import requests
+
+from api_utils import (FPL_BASE_URL, AdaptiveConcurrency, RateLimitedSession,
+                       RateLimiter, get_json, make_session, open_response,
+                       ordered_map)
+from json_stream import iter_arrays, read_chunks
+from metrics import shared_metrics
+from storage import compact_dtypes, memory_report, write_dataset
 
 
 OUTPUT_PATH = '/Users/MicahJackson/Desktop/fpl-optimiser-master/Output'
 DK_OUTPUT_PATH = ('/Users/MicahJackson/anaconda/Pycharm_WD/Draft_Kings_EPL_'
                   'Project/Output')
 
-def fetch_player_history(player_id):
+FPL_LEAGUE = 'England Premier League'  # League partition of the FPL datasets
+NO_HISTORY_SEASON = 'no_history'  # Season partition for players new to FPL
+
+# Be polite to the FPL servers, they do not publish a rate limit
+FPL_MAX_WORKERS = 8
+FPL_REQUESTS_PER_SECOND = 10
+
+FPL_SESSION = make_session(pool_size=FPL_MAX_WORKERS)  # Shared keep-alive pool
+
+BOOTSTRAP_URL = FPL_BASE_URL + '/bootstrap-static/'
+BOOTSTRAP_FILE = 'Bootstrap_static_{}.json'
+BOOTSTRAP_TIME_FORMAT = '%Y%m%dT%H%M%SZ'
+BOOTSTRAP_SNAPSHOTS_KEPT = 3  # Older snapshots are deleted, each is a few MB
+
+# Columns kept from each bootstrap-static table, with their dtypes
+BOOTSTRAP_DTYPES = {
+    'elements': {
+        'id': 'int64',
+        'code': 'int64',
+        'element_type': 'int64',
+        'team': 'int64',
+        'team_code': 'int64',
+        'first_name': 'string',
+        'second_name': 'string',
+        'web_name': 'string',
+        'status': 'category',
+        'now_cost': 'Int16',
+        'selected_by_percent': 'Float32',
+        'form': 'Float32',
+        'value_form': 'Float32',
+        'news': 'string',
+        'chance_of_playing_next_round': 'Int8',
+        'minutes': 'Int32',
+        'goals_scored': 'Int16',
+        'assists': 'Int16',
+        'total_points': 'Int16',
+    },
+    'element_types': {
+        'id': 'int64',
+        'singular_name': 'string',
+        'singular_name_short': 'string',
+        'plural_name': 'string',
+        'squad_select': 'Int8',
+    },
+    'teams': {
+        'id': 'int64',
+        'code': 'int64',
+        'name': 'string',
+        'short_name': 'string',
+        'strength': 'Int8',
+    },
+    'events': {
+        'id': 'int64',
+        'name': 'string',
+        'deadline_time': 'datetime64[ns, UTC]',
+        'finished': 'boolean',
+        'is_previous': 'boolean',
+        'is_current': 'boolean',
+        'is_next': 'boolean',
+    },
+}
+
+
+@dataclass
+class BootstrapSnapshot:
+    """ Typed tables from one fetch of bootstrap-static """
+    fetched_at: datetime
+    elements: pd.DataFrame
+    element_types: pd.DataFrame
+    teams: pd.DataFrame
+    events: pd.DataFrame
+
+
+bootstrap_snapshot = None  # Snapshot reused by every stage in this process
+
+
+def fetch_player_history(player_id, session=FPL_SESSION):
     """
 
     Fetch JSON of a single player's FPL history
 
     :param player_id: Individual Player ids as integers
+    :param session: Requests session to fetch with
 
     :return player_history: Dictionary of a players history within the EPL and
                             all subsequent official EPL fantasy metrics
 
     """
-    url = ('https://fantasy.premierleague.com/api/element-summary/{}/'
-           .format(player_id))
-    r = requests.get(url)
-    return r.json()['history_past']
+    url = FPL_BASE_URL + '/element-summary/{}/'.format(player_id)
+    # Players missing data have no history_past
+    return get_json(session, url).get('history_past', [])
+
+
+def typed_table(records, dtypes):
+    """
+
+    Build a dataframe holding only the given columns, cast to their dtypes
+
+    :param records: List of dictionaries from bootstrap-static
+    :param dtypes: Dictionary of column name to dtype
+
+    :return table: Pandas dataframe with the columns in dtypes
+    """
+    table = pd.DataFrame.from_records(records).reindex(columns=list(dtypes))
+    for column, dtype in dtypes.items():
+        if dtype.startswith('datetime'):
+            table[column] = pd.to_datetime(table[column], utc=True)
+        elif dtype in ('string', 'category', 'boolean'):
+            table[column] = table[column].astype(dtype)
+        else:  # FPL sends some numbers as strings, e.g. form
+            table[column] = (pd.to_numeric(table[column], errors='coerce')
+                             .astype(dtype))
+    return table
+
+
+def bootstrap_tables(items):
+    """
+
+    Collect streamed bootstrap-static records, keeping only the columns used
+
+    :param items: (table name, record) pairs from iter_json or iter_arrays,
+                  for the tables in BOOTSTRAP_DTYPES
+
+    :return bootstrap: Dictionary of table name to a list of records
+    """
+    bootstrap = {name: [] for name in BOOTSTRAP_DTYPES}
+    for name, record in items:
+        bootstrap[name].append({column: record.get(column)
+                                for column in BOOTSTRAP_DTYPES[name]})
+    return bootstrap
+
+
+def build_bootstrap_snapshot(bootstrap, fetched_at):
+    """
+
+    Turn a decoded bootstrap-static payload into typed tables
+
+    :param bootstrap: Decoded bootstrap-static json
+    :param fetched_at: Time the payload was fetched
+
+    :return snapshot: BootstrapSnapshot of the payload
+    """
+    tables = {name: typed_table(bootstrap[name], dtypes)
+              for name, dtypes in BOOTSTRAP_DTYPES.items()}
+    return BootstrapSnapshot(fetched_at=fetched_at, **tables)
+
+
+def load_bootstrap_snapshot(refresh=False):
+    """
+
+    Fetch bootstrap-static once per run and share it between every stage
+
+    The first call copies the payload, straight from the response cache it
+    is streamed into, to OUTPUT_PATH under a name stamped with when it was
+    fetched, and keeps the typed tables decoded from that copy in memory.
+    Only the tables and columns in BOOTSTRAP_DTYPES are decoded, streamed
+    record by record. Just the latest BOOTSTRAP_SNAPSHOTS_KEPT copies are
+    kept. Later calls return the same snapshot unless refresh is set.
+
+    :param refresh: Fetch a new snapshot even if one is already loaded
+
+    :return snapshot: BootstrapSnapshot with elements, element_types, teams
+                      and events tables
+    """
+    global bootstrap_snapshot
+    if bootstrap_snapshot is not None and not refresh:
+        return bootstrap_snapshot
+
+    body, meta = open_response(FPL_SESSION, BOOTSTRAP_URL)
+    fetched_at = datetime.fromtimestamp(meta['fetched_at'], timezone.utc)
+    snapshot_file = os.path.join(
+        OUTPUT_PATH,
+        BOOTSTRAP_FILE.format(fetched_at.strftime(BOOTSTRAP_TIME_FORMAT))
+    )
+    with body:
+        with open(snapshot_file + '.tmp', 'wb') as f:
+            shutil.copyfileobj(body, f)
+    os.replace(snapshot_file + '.tmp', snapshot_file)
+    prune_bootstrap_snapshots(OUTPUT_PATH)
+
+    bootstrap_snapshot = read_bootstrap_snapshot(snapshot_file)
+    return bootstrap_snapshot
+
+
+def prune_bootstrap_snapshots(path, keep=BOOTSTRAP_SNAPSHOTS_KEPT):
+    """ Delete all but the latest keep bootstrap snapshots saved in path """
+    prefix, suffix = BOOTSTRAP_FILE.split('{}')
+    # The timestamps sort in time order
+    snapshot_files = sorted(name for name in os.listdir(path)
+                            if name.startswith(prefix)
+                            and name.endswith(suffix))
+    for name in snapshot_files[:-keep]:
+        os.remove(os.path.join(path, name))
+
+
+def read_bootstrap_snapshot(snapshot_file):
+    """
+
+    Load a snapshot previously saved by load_bootstrap_snapshot
 
+    :param snapshot_file: Path of a saved bootstrap-static json
 
-def fetch_all_player_histories(max_id=1000):
+    :return snapshot: BootstrapSnapshot of the saved payload
+    """
+    timestamp = (os.path.basename(snapshot_file)
+                 [len(BOOTSTRAP_FILE.format('')) - len('.json'):-len('.json')])
+    fetched_at = (datetime.strptime(timestamp, BOOTSTRAP_TIME_FORMAT)
+                  .replace(tzinfo=timezone.utc))
+    with open(snapshot_file, 'rb') as f:
+        bootstrap = bootstrap_tables(
+            iter_arrays(read_chunks(f), (), BOOTSTRAP_DTYPES)
+        )
+    return build_bootstrap_snapshot(bootstrap, fetched_at)
+
+
+def fetch_element_ids(snapshot=None):
+    """ Fetch the id of every player (element) in the current season """
+    snapshot = snapshot or load_bootstrap_snapshot()
+    return snapshot.elements['id'].tolist()
+
+
+def fetch_all_player_histories(player_ids=None,
+                               max_workers=FPL_MAX_WORKERS,
+                               requests_per_second=FPL_REQUESTS_PER_SECOND):
     """
 
     Fetch the histories of all EPL players
 
-    :param max_id: Integer ids to iterate through for EPL players
+    Histories are fetched concurrently under a token bucket rate limit, for
+    exactly the ids listed in bootstrap-static rather than probing ids until
+    one fails. Concurrency shrinks while the api throttles requests, and a
+    history that cannot be fetched raises rather than being left out.
+
+    :param player_ids: Integer ids of the EPL players to fetch, defaults to
+                       every player in the current season
+    :param max_workers: Number of histories fetched at the same time
+    :param requests_per_second: Client-side rate limit for the FPL api
 
     :return histories: Dictionaries of individual EPL player data for all
                        their seasons in the EPL
     """
+    if player_ids is None:
+        player_ids = fetch_element_ids()
+
+    session = RateLimitedSession(FPL_SESSION,
+                                 RateLimiter(requests_per_second,
+                                             burst=max_workers),
+                                 AdaptiveConcurrency(max_workers))
+    fetch = partial(fetch_player_history, session=session)
+
+    pages = ordered_map(fetch, player_ids, max_workers=max_workers)
+
     histories = []
-    bar = progressbar.ProgressBar()
-    for player_id in tqdm(range(1, max_id+1), desc='Get player histories'):
-        try:
-            history = fetch_player_history(player_id)
-            histories += history
-        except json.decoder.JSONDecodeError:
-            print('\nLast player found at id = {0}'.format(player_id - 1))
-            return histories
-        except KeyError:  # Catching key errors for players missing data
-            pass
-        time.sleep(0.5)  # To avoid overloading their servers
-    else:
-        warnings.warn('Last player_id not reached. You ought to try again '
-                      'with a higher max_id')
-        return histories
-
-
-def fetch_positions():
+    for history in tqdm(pages,
+                        total=len(player_ids),
+                        desc='Get player histories'):
+        histories += history
+    return histories
+
+
+def fetch_positions(snapshot=None):
     """ Fetch table mapping position_ids to position names. """
-    url = 'https://fantasy.premierleague.com/api/bootstrap-static/'
-    r = requests.get(url)
-    positions = r.json()['element_types']
-    return positions
+    snapshot = snapshot or load_bootstrap_snapshot()
+    return snapshot.element_types
 
 
-def fetch_player_info():
+def fetch_player_info(snapshot=None):
     """ Fetch player info for the most recent season. """
-    url = 'https://fantasy.premierleague.com/api/bootstrap-static/'
-    r = requests.get(url)
-
-    positions = []
-    for player in r.json()['elements']:
-        positions.append({
-            'position_id': player['element_type'],
-            'player_id': player['code'],
-            'team_id': player['team_code'],
-            'full_name': player['first_name'] + ' ' + player['second_name'],
-            'now_cost': player['now_cost'],
-            'selected_by': player['selected_by_percent'],
-            'player_form' :player['form'],  # ADDED THESE 4 ELEMENTS IN
-            'value_to_form_ratio': player['value_form'],
-            'player_news': player['news'],
-            'chance_of_playing_next_round': player['chance_of_playing'
-                                                   '_next_round']
-        })
+    elements = (snapshot or load_bootstrap_snapshot()).elements
+    positions = pd.DataFrame({
+        'position_id': elements['element_type'],
+        'player_id': elements['code'],
+        'team_id': elements['team_code'],
+        'full_name': elements['first_name'] + ' ' + elements['second_name'],
+        'now_cost': elements['now_cost'],
+        'selected_by': elements['selected_by_percent'],
+        'player_form': elements['form'],  # ADDED THESE 4 ELEMENTS IN
+        'value_to_form_ratio': elements['value_form'],
+        'player_news': elements['news'],
+        'chance_of_playing_next_round': elements['chance_of_playing'
+                                                 '_next_round']
+    })
     return positions
 
 
-def fetch_and_save_history(max_id=1000):
-    """ Fetch and save all historical seasons """
-    scores = pd.DataFrame(fetch_all_player_histories(max_id))
-    players = pd.DataFrame(fetch_player_info())
-    positions = pd.DataFrame(fetch_positions())
+def save_history(history, root):
+    """
 
-    print(players)
+    Save the FPL history dataset, one partition per season
+
+    :param history: Pandas dataframe of FPL player histories
+    :param root: Output directory holding every dataset
+    """
+    seasons = history['season_name'].fillna(NO_HISTORY_SEASON)
+    for season, season_df in history.groupby(seasons):
+        write_dataset(season_df, root, 'fpl_history', FPL_LEAGUE, season)
+
+
+def build_history(scores, players, positions):
+    """
 
+    Join player histories to the current player info and positions
+
+    :param scores: Pandas dataframe of history_past rows
+    :param players: Player info from fetch_player_info
+    :param positions: Positions from fetch_positions
+
+    :return history: Pandas dataframe of the FPL history dataset columns
+    """
     # Add position info and clean up columns
     history = scores.merge(players,
                            how='outer',
@@ -148,22 +379,42 @@ def fetch_and_save_history(max_id=1000):
                'chance_of_playing_next_round']
 
     history = history[columns]
-    history = history.rename(columns={'singular_name': 'position',
-                                      'bps': 'bonus_points'})
+    return history.rename(columns={'singular_name': 'position',
+                                   'bps': 'bonus_points'})
 
-    positions.to_csv(os.path.join(OUTPUT_PATH,'Positions.csv'),
-                     index=False,
-                     encoding='utf-8')
 
-    history.to_csv(os.path.join(OUTPUT_PATH,'FPL_history.csv'),
-                   index=False,
-                   encoding='utf-8')
+def fetch_and_save_history():
+    """ Fetch and save all historical seasons """
+    metrics = shared_metrics()
+    with metrics.stage('bootstrap') as stage:
+        snapshot = load_bootstrap_snapshot()
+        stage.rows = len(snapshot.elements)
+    player_ids = fetch_element_ids(snapshot)
+    with metrics.stage('player_histories') as stage:
+        scores = pd.DataFrame(fetch_all_player_histories(player_ids))
+        stage.rows = len(scores)
+    players = fetch_player_info(snapshot)
+    positions = fetch_positions(snapshot)
+
+    print(players)
 
-    history.to_csv(os.path.join(DK_OUTPUT_PATH,'FPL_history.csv'),
-                   index=False,
-                   encoding='utf-8')
+    with metrics.stage('history_merge') as stage:
+        raw_history = build_history(scores, players, positions)
+        history = compact_dtypes(raw_history, 'fpl_history')
+        stage.rows = len(history)
+    print(memory_report(raw_history, history))
+    del raw_history
+    with metrics.stage('save_history') as stage:
+        write_dataset(positions, OUTPUT_PATH, 'positions')
+        save_history(history, OUTPUT_PATH)
+        if DK_OUTPUT_PATH != OUTPUT_PATH:
+            save_history(history, DK_OUTPUT_PATH)
+        stage.rows = len(history)
 
 
 if __name__ == '__main__':
     print('Running code')
-    fetch_and_save_history()
+    try:
+        fetch_and_save_history()
+    finally:
+        shared_metrics().save(OUTPUT_PATH, 'fetch_history')
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+
+Per-player season totals used to check name matches against player stats
+
+"""
+
+__author__ = 'Micah Cearns'
+__contact__ = 'micahcearns@gmail.com'
+__date__ = 'August 2020'
+
+import json
+import os
+
+import pandas as pd
+
+from storage import dataset_path, read_dataset, write_dataset
+
+# Source columns summed into each season total
+FAPI_STATS = {'minutes_played': 'minutes',
+              'goals.total': 'goals',
+              'goals.assists': 'assists',
+              'goals.saves': 'saves'}
+FPL_STATS = {'minutes': 'minutes',
+             'goals_scored': 'goals',
+             'assists': 'assists',
+             'saves': 'saves'}
+STAT_COLUMNS = ['minutes', 'goals', 'assists', 'saves']
+
+AGGREGATE_DATASET = 'fapi_season_aggregates'
+FIXTURES_FILE = '_fixtures.json'  # Fixtures already in each partition's totals
+ASSIST_TOLERANCE = 1  # The two sources do not always credit the same assists
+
+
+def season_aggregates(df, stats):
+    """
+
+    Sum each player's stats over the rows of df
+
+    :param df: Pandas dataframe with a player_id column and the stats columns
+    :param stats: Dictionary of source column to STAT_COLUMNS name
+
+    :return aggregates: Pandas dataframe of STAT_COLUMNS indexed by player_id
+    """
+    return (df[['player_id'] + list(stats)]
+            .rename(columns=stats)
+            .groupby('player_id')
+            .sum()
+            .reindex(columns=STAT_COLUMNS, fill_value=0)
+            .astype('int64'))
+
+
+def update_aggregates(aggregates, new_rows, stats):
+    """
+
+    Fold rows for new fixtures into existing season totals
+
+    :param aggregates: Totals from season_aggregates
+    :param new_rows: Rows that are not yet part of the totals
+    :param stats: Dictionary of source column to STAT_COLUMNS name
+
+    :return aggregates: Updated totals
+    """
+    return (aggregates
+            .add(season_aggregates(new_rows, stats), fill_value=0)
+            .astype('int64'))
+
+
+def load_fapi_aggregates(root, league, season):
+    """
+
+    Load the materialised football api season totals for a league season
+
+    Fixtures added to the player_fixture partition since the totals were last
+    saved are folded in and the totals saved again, so each fixture is only
+    ever summed once.
+
+    :param root: Output directory holding every dataset
+    :param league: League partition
+    :param season: Season partition
+
+    :return aggregates: Pandas dataframe of STAT_COLUMNS indexed by player_id
+    """
+    path = dataset_path(root, AGGREGATE_DATASET, league, season)
+    fixtures_file = os.path.join(path, FIXTURES_FILE)
+    if os.path.exists(fixtures_file):
+        with open(fixtures_file) as f:
+            included = set(json.load(f))
+        aggregates = (read_dataset(root,
+                                   AGGREGATE_DATASET,
+                                   columns=['player_id'] + STAT_COLUMNS,
+                                   league=league,
+                                   season=season)
+                      .set_index('player_id'))
+    else:
+        included = set()
+        aggregates = pd.DataFrame(columns=STAT_COLUMNS,
+                                  index=pd.Index([], name='player_id'),
+                                  dtype='int64')
+
+    columns = ['event_id', 'player_id'] + list(FAPI_STATS)
+    fixtures = read_dataset(root,
+                            'player_fixture',
+                            columns=columns,
+                            league=league,
+                            season=season)
+    new_rows = fixtures.loc[~fixtures['event_id'].isin(included)]
+    if new_rows.empty:
+        return aggregates
+
+    aggregates = update_aggregates(aggregates, new_rows, FAPI_STATS)
+    write_dataset(aggregates.reset_index(),
+                  root,
+                  AGGREGATE_DATASET,
+                  league,
+                  season)
+    included |= set(new_rows['event_id'].astype(int).tolist())
+    tmp_file = fixtures_file + '.tmp'  # A crash never leaves half a file
+    with open(tmp_file, 'w') as f:
+        json.dump(sorted(included), f)
+    os.replace(tmp_file, fixtures_file)
+    return aggregates
+
+
+def stats_by_name(aggregates, df):
+    """
+
+    Index season totals by the players' current parsed names
+
+    :param aggregates: Totals indexed by player_id
+    :param df: Pandas dataframe with player_id and parsed_full_name columns,
+               only players in df are kept
+
+    :return stats: Pandas dataframe of STAT_COLUMNS indexed by
+                   parsed_full_name
+    """
+    names = (df[['player_id', 'parsed_full_name']]
+             .drop_duplicates('player_id')
+             .set_index('player_id')['parsed_full_name']
+             .astype(str))
+    return (aggregates
+            .join(names, how='inner')
+            .groupby('parsed_full_name')
+            .sum())
+
+
+def compare_candidates(matches, fapi_stats, fpl_stats):
+    """
+
+    Put each candidate match next to both sources' season totals
+
+    :param matches: Pandas dataframe with query_name (football api name) and
+                    candidate_name (FPL name) columns, e.g. from match_names
+    :param fapi_stats: Football api totals from stats_by_name
+    :param fpl_stats: FPL totals from stats_by_name
+
+    :return comparison: matches with fapi_ and fpl_ prefixed totals and a
+                        stats_agree column that is True when goals match and
+                        assists are within ASSIST_TOLERANCE
+    """
+    comparison = (matches
+                  .join(fapi_stats.add_prefix('fapi_'), on='query_name')
+                  .join(fpl_stats.add_prefix('fpl_'), on='candidate_name'))
+    comparison['stats_agree'] = (
+        (comparison['fapi_goals'] == comparison['fpl_goals'])
+        & ((comparison['fapi_assists'] - comparison['fpl_assists']).abs()
+           <= ASSIST_TOLERANCE)
+    )
+    return comparison
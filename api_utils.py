@@ -0,0 +1,779 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+
+Shared HTTP helpers for the football api and the official EPL api
+
+"""
+
+__author__ = 'Micah Cearns'
+__contact__ = 'micahcearns@gmail.com'
+__date__ = 'August 2020'
+
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from json_stream import CHUNK_SIZE, iter_arrays, read_chunks
+from metrics import shared_metrics
+
+# Where the apis are served from, e.g. a local mock_api_server.py
+FAPI_BASE_URL = os.environ.get('FAPI_BASE_URL',
+                               'https://api-football-v1.p.rapidapi.com/v2')
+FPL_BASE_URL = os.environ.get('FPL_BASE_URL',
+                              'https://fantasy.premierleague.com/api')
+
+CACHE_PATH = os.environ.get('EPL_CACHE_PATH',
+                            os.path.join(os.path.expanduser('~'),
+                                         '.cache',
+                                         'draft_kings_epl'))
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+OFFLINE = os.environ.get('EPL_OFFLINE', '0') == '1'  # Replay from cache only
+
+# Seconds a cached response stays fresh, keyed on a url fragment. The first
+# matching fragment wins and None means the response never changes.
+CACHE_TTLS = [
+    ('/players/fixture/', 60 * 60),  # Callers pass None for finished fixtures
+    ('/fixtures/league/', 60 * 60),
+    ('/leagues', 24 * 60 * 60),
+    # Element ids are reassigned every season and history_past gains a row
+    # when one ends, so a summary cannot be kept across seasons
+    ('/element-summary/', 24 * 60 * 60),
+    ('/bootstrap-static/', 5 * 60),
+]
+DEFAULT_TTL = 60 * 60
+ENDPOINT_TTL = object()  # Sentinel for "look the ttl up in CACHE_TTLS"
+
+REQUEST_TIMEOUT = 30  # Seconds
+MAX_RETRIES = 5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+THROTTLE_STATUSES = {429, 503}  # Shrink the concurrency when these appear
+BACKOFF_BASE = 1.0  # Seconds, doubled on every retry
+BACKOFF_MAX = 60.0
+MAX_RETRY_AFTER = 5 * 60  # Longer waits (e.g. a spent daily quota) fail now
+QUOTA_REMAINING_HEADER = 'x-ratelimit-requests-remaining'  # Sent by RapidAPI
+
+
+class RateLimiter:
+    """
+
+    Thread-safe token bucket limiting how quickly requests are sent
+
+    :param rate: Number of requests allowed per second
+    :param burst: Number of requests that may be sent back to back before
+                  the rate applies
+
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.capacity = float(max(burst, 1))
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until a request may be sent """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+
+    RateLimiter whose token bucket is shared by every process of a pool
+
+    Create it in the parent process and hand it to the workers through the
+    pool initializer.
+
+    :param rate: Number of requests allowed per second across all processes
+    :param burst: Number of requests that may be sent back to back before
+                  the rate applies
+
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.capacity = float(max(burst, 1))
+        self.bucket = multiprocessing.Array('d',
+                                            [self.capacity, time.monotonic()],
+                                            lock=False)
+        self.lock = multiprocessing.Lock()
+
+    @property
+    def tokens(self):
+        return self.bucket[0]
+
+    @tokens.setter
+    def tokens(self, value):
+        self.bucket[0] = value
+
+    @property
+    def last(self):
+        return self.bucket[1]
+
+    @last.setter
+    def last(self, value):
+        self.bucket[1] = value
+
+
+class AdaptiveConcurrency:
+    """
+
+    AIMD limit on the number of requests in flight
+
+    Every response that is not throttled grows the limit by 1 / limit, so
+    about one more request is allowed per round trip of the whole window,
+    and a throttled response halves it. Only requests sent after the last
+    decrease can shrink the limit again, so a burst of 429s from one window
+    of requests halves it once.
+
+    :param max_limit: Highest limit, e.g. the number of worker threads
+    :param min_limit: Lowest limit
+
+    """
+
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max(max_limit, min_limit)
+        self.min_limit = min_limit
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.last_decrease = float('-inf')
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """ Block until a request may be sent, returning when it was sent """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, sent_at, throttled=False):
+        """ Free the slot of a request sent at sent_at """
+        with self.condition:
+            self.in_flight -= 1
+            if not throttled:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif sent_at > self.last_decrease:
+                self.limit = max(self.min_limit, self.limit / 2)
+                self.last_decrease = time.monotonic()
+            self.condition.notify_all()
+
+
+class BudgetExhaustedError(RuntimeError):
+    """ Raised when a request would go over the daily request budget """
+
+
+class RequestBudget:
+    """
+
+    Thread-safe daily request budget shared by every run on the same day
+
+    Requests sent in the current UTC day, when RapidAPI quotas reset, are
+    counted in a small json state file, which is read again before every
+    change. Whenever the api reports how much of its quota is left the count
+    catches up with it, so requests sent from elsewhere with the same key are
+    accounted for too.
+
+    :param limit: Number of requests allowed per day
+    :param state_file: Json file holding the day and the requests used
+    :param lock: Lock guarding the state file, pass a multiprocessing lock
+                 when processes share the budget
+
+    """
+
+    def __init__(self, limit, state_file, lock=None):
+        self.limit = limit
+        self.state_file = state_file
+        self.lock = lock if lock is not None else threading.Lock()
+        with self.lock:
+            self.refresh()
+
+    @staticmethod
+    def today():
+        return datetime.now(timezone.utc).date().isoformat()
+
+    def refresh(self):
+        """ Load today's count from the state file, with the lock held """
+        self.day, self.used = self.today(), 0
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        if state.get('day') == self.day:
+            self.used = state['used']
+
+    def save(self):
+        """ Atomically write the count, called with the lock held """
+        os.makedirs(os.path.dirname(self.state_file) or '.', exist_ok=True)
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'day': self.day, 'used': self.used}, f)
+        os.replace(tmp_file, self.state_file)
+
+    def remaining(self):
+        """ Requests left today """
+        with self.lock:
+            self.refresh()
+            return max(self.limit - self.used, 0)
+
+    def spend(self):
+        """ Count a request about to be sent, raising once none are left """
+        with self.lock:
+            self.refresh()
+            if self.used >= self.limit:
+                raise BudgetExhaustedError(
+                    'Daily budget of {} requests used up'.format(self.limit)
+                )
+            self.used += 1
+            self.save()
+
+    def observe(self, quota_remaining):
+        """ Catch up with the quota the api says is left today """
+        with self.lock:
+            self.refresh()
+            if self.limit - quota_remaining > self.used:
+                self.used = self.limit - quota_remaining
+                self.save()
+
+
+class RateLimitedSession:
+    """
+
+    Wrap a session so every GET first waits on a rate limiter
+
+    Passed to get_json so that cache hits skip the limiter, and the budget,
+    entirely.
+
+    :param session: Requests session
+    :param rate_limiter: RateLimiter shared by every user of the session
+    :param concurrency: Optional AdaptiveConcurrency shared by every user of
+                        the session
+    :param budget: Optional RequestBudget every request is counted against
+
+    """
+
+    def __init__(self, session, rate_limiter, concurrency=None, budget=None):
+        self.session = session
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+        self.budget = budget
+
+    def get(self, url, **kwargs):
+        if self.budget:
+            self.budget.spend()
+        sent_at = self.concurrency.acquire() if self.concurrency else None
+        throttled = True  # Connection errors count as congestion
+        try:
+            start = time.perf_counter()
+            self.rate_limiter.acquire()
+            shared_metrics().record_wait(url, time.perf_counter() - start)
+            response = self.session.get(url, **kwargs)
+            throttled = response.status_code in THROTTLE_STATUSES
+            quota_remaining = response.headers.get(QUOTA_REMAINING_HEADER)
+            if self.budget and quota_remaining is not None:
+                try:
+                    self.budget.observe(int(quota_remaining))
+                except ValueError:
+                    pass
+            return response
+        finally:
+            if self.concurrency:
+                self.concurrency.release(sent_at, throttled)
+
+
+def make_session(headers=None, pool_size=10):
+    """
+
+    Create a requests session with a keep-alive connection pool
+
+    :param headers: Headers sent with every request
+    :param pool_size: Number of connections kept open per host, should match
+                      the number of worker threads sharing the session
+
+    :return session: Pooled requests session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def ordered_map(func, items, max_workers=8):
+    """
+
+    Apply func to items across a thread pool, yielding results in input order
+
+    At most 2 * max_workers calls are in flight at once, so results are never
+    buffered for the whole input.
+
+    :param func: Callable taking a single item
+    :param items: Iterable of items to process
+    :param max_workers: Number of worker threads
+
+    :return results: Generator of func(item) in the same order as items
+    """
+    window = max_workers * 2
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = deque()
+        for item in items:
+            futures.append(executor.submit(func, item))
+            if len(futures) >= window:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+class CacheMissError(LookupError):
+    """ Raised in offline mode when a request has not been cached """
+
+
+class ResponseCache:
+    """
+
+    Size-bounded on-disk cache of raw API response bodies
+
+    Entries are keyed on url and query params (never headers, so the API key
+    is not part of the key). Each entry is a body file plus a small json file
+    of metadata. The least recently used entries are evicted once the cache
+    grows past max_bytes.
+
+    :param path: Directory holding the cache
+    :param max_bytes: Maximum total size of cached bodies
+    :param offline: Serve stale entries and never touch the network
+    :param ttls: List of (url fragment, seconds) pairs, see CACHE_TTLS
+
+    """
+
+    def __init__(self,
+                 path=CACHE_PATH,
+                 max_bytes=CACHE_MAX_BYTES,
+                 offline=OFFLINE,
+                 ttls=CACHE_TTLS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.ttls = ttls
+        self.lock = threading.Lock()
+        self.sizes = OrderedDict()  # key -> body size, least recent first
+        self.total_bytes = 0
+        os.makedirs(self.path, exist_ok=True)
+
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.body'):
+                stat = os.stat(os.path.join(self.path, name))
+                entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.sizes[key] = size
+            self.total_bytes += size
+
+    @staticmethod
+    def key(url, params=None):
+        """ Hash of the url and sorted query params """
+        params = sorted((params or {}).items())
+        raw = json.dumps([url, params], default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def ttl_for(self, url):
+        """ Seconds a response from url stays fresh, None for never stale """
+        for fragment, ttl in self.ttls:
+            if fragment in url:
+                return ttl
+        return DEFAULT_TTL
+
+    def files(self, key):
+        base = os.path.join(self.path, key)
+        return base + '.body', base + '.json'
+
+    def is_fresh(self, meta):
+        """ Whether an entry with the given metadata may still be served """
+        return (self.offline
+                or meta['ttl'] is None
+                or time.time() - meta['fetched_at'] <= meta['ttl'])
+
+    def contains(self, url, params=None):
+        """ Whether a fresh response is cached, without reading its body """
+        _, meta_file = self.files(self.key(url, params))
+        try:
+            with open(meta_file) as f:
+                return self.is_fresh(json.load(f))
+        except (OSError, ValueError):
+            return False
+
+    def open_entry(self, url, params=None):
+        """
+
+        Open a cached response body for reading, along with its metadata
+
+        :param url: Request url
+        :param params: Request query params
+
+        :return file: Binary file of the cached body, or None when missing or
+                      stale
+        :return meta: Dictionary of the entry's url, params, fetched_at (unix
+                      time) and ttl, or None when missing or stale
+        """
+        key = self.key(url, params)
+        body_file, meta_file = self.files(key)
+        try:
+            with open(meta_file) as f:
+                meta = json.load(f)
+            if not self.is_fresh(meta):
+                return None, None
+            body = open(body_file, 'rb')
+        except (OSError, ValueError):
+            return None, None
+
+        with self.lock:
+            if key in self.sizes:
+                self.sizes.move_to_end(key)
+        os.utime(body_file)  # Keeps the LRU order across runs
+        return body, meta
+
+    def open_body(self, url, params=None):
+        """ Open a cached response body, None when missing or stale """
+        return self.open_entry(url, params)[0]
+
+    def get(self, url, params=None):
+        """
+
+        Look up a cached response body
+
+        :param url: Request url
+        :param params: Request query params
+
+        :return body: Cached bytes, or None when missing or stale
+        """
+        body = self.open_body(url, params)
+        if body is None:
+            return None
+        with body:
+            return body.read()
+
+    def put(self, url, params, body, ttl=ENDPOINT_TTL):
+        """
+
+        Store a response body
+
+        :param url: Request url
+        :param params: Request query params
+        :param body: Raw response bytes
+        :param ttl: Seconds the response stays fresh, None for never stale
+        """
+        self.put_chunks(url, params, [body], ttl)
+
+    def put_chunks(self, url, params, chunks, ttl=ENDPOINT_TTL):
+        """
+
+        Store a response body arriving in chunks, without holding all of it
+
+        :param url: Request url
+        :param params: Request query params
+        :param chunks: Iterable of raw response bytes
+        :param ttl: Seconds the response stays fresh, None for never stale
+
+        :return size: Size of the stored body in bytes
+        """
+        if ttl is ENDPOINT_TTL:
+            ttl = self.ttl_for(url)
+        key = self.key(url, params)
+        body_file, meta_file = self.files(key)
+        meta = {'url': url,
+                'params': params,
+                'fetched_at': time.time(),
+                'ttl': ttl}
+
+        # Write to temporary files first so readers never see half an entry.
+        # The cache may be shared by several processes, hence the pid.
+        suffix = '.{}.{}.tmp'.format(os.getpid(), threading.get_ident())
+        size = 0
+        try:
+            with open(body_file + suffix, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+            with open(meta_file + suffix, 'w') as f:
+                json.dump(meta, f, default=str)
+        except BaseException:  # E.g. the connection dropped mid-stream
+            for file in (body_file + suffix, meta_file + suffix):
+                try:
+                    os.remove(file)
+                except OSError:
+                    pass
+            raise
+        os.replace(body_file + suffix, body_file)
+        os.replace(meta_file + suffix, meta_file)
+
+        with self.lock:
+            self.total_bytes += size - self.sizes.pop(key, 0)
+            self.sizes[key] = size
+            self.evict()
+        return size
+
+    def evict(self):
+        """ Drop least recently used entries until under max_bytes """
+        while self.total_bytes > self.max_bytes and self.sizes:
+            key, size = self.sizes.popitem(last=False)
+            self.total_bytes -= size
+            for file in self.files(key):
+                try:
+                    os.remove(file)
+                except OSError:
+                    pass
+
+
+shared_cache_lock = threading.Lock()
+shared_cache_instance = None
+
+
+def shared_cache():
+    """ Cache shared by every fetcher in the process """
+    global shared_cache_instance
+    with shared_cache_lock:
+        if shared_cache_instance is None:
+            shared_cache_instance = ResponseCache()
+        return shared_cache_instance
+
+
+def retry_after_seconds(value):
+    """ Seconds asked for by a Retry-After header, None if absent or bad """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+
+    Seconds to wait before retrying a request
+
+    :param attempt: Number of retries already made
+    :param retry_after: Seconds the server asked for, if it did
+
+    :return delay: The server's wait plus a little jitter, otherwise
+                   exponential backoff with full jitter
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, BACKOFF_BASE)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def send_with_retries(session,
+                      url,
+                      params=None,
+                      max_retries=MAX_RETRIES,
+                      stream=False):
+    """
+
+    GET a url, retrying until it succeeds or can not be retried
+
+    Connection errors, timeouts and RETRY_STATUSES responses are retried with
+    backoff, honouring Retry-After. Any other error, or running out of
+    retries, raises.
+
+    :param session: Requests session
+    :param url: Request url
+    :param params: Request query params
+    :param max_retries: Number of retries before giving up
+    :param stream: Leave the body of a successful response unread, for the
+                   caller to stream and record in the metrics
+
+    :return response: Successful response
+    """
+    metrics = shared_metrics()
+    attempt = 0
+    while True:
+        try:
+            response = session.get(url,
+                                   params=params,
+                                   timeout=REQUEST_TIMEOUT,
+                                   stream=stream)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt)
+        else:
+            if not (stream and response.ok):
+                metrics.record_request(url,
+                                       response.status_code,
+                                       response.elapsed.total_seconds(),
+                                       len(response.content))
+            if (response.status_code not in RETRY_STATUSES
+                    or attempt >= max_retries):
+                break
+            retry_after = retry_after_seconds(
+                response.headers.get('Retry-After')
+            )
+            if retry_after is not None and retry_after > MAX_RETRY_AFTER:
+                break
+            delay = backoff_delay(attempt, retry_after)
+        metrics.record_retry(url)
+        time.sleep(delay)
+        attempt += 1
+
+    response.raise_for_status()
+    return response
+
+
+def get_json(session,
+             url,
+             params=None,
+             ttl=ENDPOINT_TTL,
+             cache=None,
+             max_retries=MAX_RETRIES):
+    """
+
+    GET a json endpoint through the response cache
+
+    Failed requests are retried by send_with_retries, and raise rather than
+    returning a partial or error payload once they can not be. Only
+    successful responses are cached, so an error page is never replayed.
+
+    :param session: Requests session to use on a cache miss
+    :param url: Request url
+    :param params: Request query params
+    :param ttl: Seconds the response stays fresh, None for never stale.
+                Defaults to the endpoint's entry in CACHE_TTLS
+    :param cache: ResponseCache to use, defaults to shared_cache()
+    :param max_retries: Number of retries before giving up
+
+    :return data: Decoded json response
+    """
+    cache = cache if cache is not None else shared_cache()
+    body = cache.get(url, params)
+    if body is not None:
+        shared_metrics().record_cache_hit(url)
+        return json.loads(body)
+    if cache.offline:
+        raise CacheMissError('No cached response for {}'.format(url))
+
+    response = send_with_retries(session, url, params, max_retries)
+    data = response.json()
+    cache.put(url, params, response.content, ttl)
+    return data
+
+
+def open_response(session,
+                  url,
+                  params=None,
+                  ttl=ENDPOINT_TTL,
+                  cache=None,
+                  max_retries=MAX_RETRIES):
+    """
+
+    Open a response body from the response cache, fetching it on a miss
+
+    On a miss the body is streamed from the network into the cache, so it is
+    never held in memory. Requests are retried and cached as in get_json.
+
+    :param session: Requests session to use on a cache miss
+    :param url: Request url
+    :param params: Request query params
+    :param ttl: Seconds the response stays fresh, None for never stale.
+                Defaults to the endpoint's entry in CACHE_TTLS
+    :param cache: ResponseCache to use, defaults to shared_cache()
+    :param max_retries: Number of retries before giving up
+
+    :return file: Binary file of the body
+    :return meta: Metadata of the cache entry, see ResponseCache.open_entry
+    """
+    cache = cache if cache is not None else shared_cache()
+    metrics = shared_metrics()
+    body, meta = cache.open_entry(url, params)
+    if body is not None:
+        metrics.record_cache_hit(url)
+    elif cache.offline:
+        raise CacheMissError('No cached response for {}'.format(url))
+    else:
+        response = send_with_retries(session,
+                                     url,
+                                     params,
+                                     max_retries,
+                                     stream=True)
+        try:
+            size = cache.put_chunks(url,
+                                    params,
+                                    response.iter_content(CHUNK_SIZE),
+                                    ttl)
+        finally:
+            response.close()
+        metrics.record_request(url,
+                               response.status_code,
+                               response.elapsed.total_seconds(),
+                               size)
+        body, meta = cache.open_entry(url, params)
+        if body is None:
+            raise CacheMissError('Response for {} was evicted as soon as it '
+                                 'was cached, it is larger than the cache'
+                                 .format(url))
+    return body, meta
+
+
+def iter_json(session,
+              url,
+              path,
+              keys,
+              params=None,
+              ttl=ENDPOINT_TTL,
+              cache=None,
+              max_retries=MAX_RETRIES):
+    """
+
+    Stream the items of some arrays of a json endpoint, see iter_arrays
+
+    The response body is opened with open_response and decoded one array
+    item at a time, so neither the raw body nor the whole decoded document is
+    ever held in memory.
+
+    :param session: Requests session to use on a cache miss
+    :param url: Request url
+    :param path: Keys leading to the object holding the arrays, e.g. ('api',)
+    :param keys: Keys of the arrays wanted in that object, e.g. {'leagues'}
+    :param params: Request query params
+    :param ttl: Seconds the response stays fresh, None for never stale.
+                Defaults to the endpoint's entry in CACHE_TTLS
+    :param cache: ResponseCache to use, defaults to shared_cache()
+    :param max_retries: Number of retries before giving up
+
+    :return items: Generator of (key, item) pairs in document order
+    """
+    body, _ = open_response(session, url, params, ttl, cache, max_retries)
+    with body:
+        yield from iter_arrays(read_chunks(body), path, keys)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+
+Backfilling player fixture data over many leagues and seasons
+
+Every (league, country, season) of the matrix is resolved to its league id
+from a single leagues response, then each league season is synced into its
+own player_fixture partition by a pool of worker processes. The workers share
+one rate limit and one daily request budget. Every partition keeps its own
+watermark, so a backfill cut short by a failure or by the budget is resumed
+by running it again: complete partitions are skipped and the rest pick up
+where they stopped.
+
+"""
+
+__author__ = 'Micah Cearns'
+__contact__ = 'micahcearns@gmail.com'
+__date__ = 'August 2020'
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from api_utils import RequestBudget, SharedRateLimiter
+from metrics import reset_shared_metrics, shared_metrics
+from pipeline import load_script
+
+FIXTURE_SCRIPT = '01_Get_FAPI_Player_Fixture_Data'
+
+STATE_FILE = '_backfill_state.json'  # Outcome of every partition, in root
+DEFAULT_PROCESSES = 4
+WORKERS_PER_PROCESS = 2  # Fixtures each process fetches at the same time
+
+fixture_script = None  # The fixture script, loaded once in each process
+
+
+def parse_league(value):
+    """ Parse a 'league:country' command line argument """
+    league, sep, country = value.rpartition(':')
+    if not sep or not league or not country:
+        raise argparse.ArgumentTypeError(
+            "Expected 'league:country', e.g. 'Premier League:England', "
+            "got {!r}".format(value)
+        )
+    return league, country
+
+
+def league_matrix(leagues, seasons):
+    """
+
+    Every combination of leagues and seasons
+
+    :param leagues: List of (league, country) tuples
+    :param seasons: List of seasons, e.g. [2016, 2017]
+
+    :return matrix: List of (league, country, season) tuples
+    """
+    return [(league, country, season)
+            for (league, country), season in itertools.product(leagues,
+                                                               seasons)]
+
+
+def partition_key(league, country, season):
+    """ Key of a league season in the state file """
+    return '{} {}/{}'.format(country, league, season)
+
+
+def load_state(state_file):
+    """ Outcome of every partition backfilled so far """
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def init_worker(rate_limiter, budget_lock, root):
+    """
+
+    Share the parent's rate limit, request budget and output directory with a
+    worker process
+
+    :param rate_limiter: SharedRateLimiter created in the parent
+    :param budget_lock: Multiprocessing lock guarding the budget state file
+    :param root: Output directory the partitions are written to
+    """
+    global fixture_script
+    fixture_script = load_script(FIXTURE_SCRIPT)
+    fixture_script.OUTPUT_PATH = root
+    fixture_script.fapi_rate_limiter_instance = rate_limiter
+    if fixture_script.FAPI_DAILY_REQUESTS is not None:
+        fixture_script.fapi_budget_instance = RequestBudget(
+            fixture_script.FAPI_DAILY_REQUESTS,
+            os.path.join(fixture_script.OUTPUT_PATH,
+                         fixture_script.BUDGET_FILE),
+            lock=budget_lock
+        )
+
+
+def backfill_partition(league, country, season, league_id, max_workers):
+    """
+
+    Sync one league season into its partition, in a worker process
+
+    Requests are recorded in the worker's own shared metrics, which are
+    started afresh for every partition and sent back with its result for the
+    parent to merge. A failure is sent back the same way, so the requests
+    made before it are still counted.
+
+    :param league: Football api league name, e.g. 'Premier League'
+    :param country: Country of the league, e.g. 'England'
+    :param season: Football api season, e.g. 2019
+    :param league_id: League id of the league season
+    :param max_workers: Number of fixtures fetched at the same time
+
+    :return result: Dictionary of the fixtures fetched and deferred, whether
+                    the partition is complete (or the error it failed with)
+                    and the metrics report of the partition
+    """
+    reset_shared_metrics()
+    try:
+        result = sync_partition(league, country, season, league_id,
+                                max_workers)
+    except Exception as error:  # Resumed on the next run
+        result = {'error': repr(error), 'complete': False}
+    result['metrics'] = shared_metrics().report('backfill')
+    return result
+
+
+def sync_partition(league, country, season, league_id, max_workers):
+    """ Sync one league season, see backfill_partition """
+    headers = fixture_script.connect_to_api()
+    path, new_fixture_ids = fixture_script.sync_player_data(
+        league_id,
+        headers,
+        league='{} {}'.format(country, league),
+        season=season,
+        max_workers=max_workers
+    )
+
+    plan_file = os.path.join(path, fixture_script.PLAN_FILE)
+    plan = load_state(plan_file)
+    # Served from the cache filled by the sync, so it costs no request
+    fixture_df = fixture_script.get_fixtures(league_id, headers)
+    settled = (fixture_df['statusShort']
+               .isin(fixture_script.FINISHED_STATUSES
+                     + fixture_script.UNPLAYED_STATUSES)
+               .all())
+    return {'fetched': len(new_fixture_ids),
+            'deferred': len(plan.get('deferred', [])),
+            'complete': bool(settled) and not plan.get('deferred')}
+
+
+def run_backfill(matrix,
+                 root=None,
+                 processes=DEFAULT_PROCESSES,
+                 max_workers=WORKERS_PER_PROCESS,
+                 requests_per_minute=None,
+                 force=False):
+    """
+
+    Backfill every league season of the matrix across a process pool
+
+    Partitions that completed on an earlier run (every fixture fetched, or
+    never to be played) are skipped unless force is set. A partition that
+    fails is recorded with its error and left for the next run to resume.
+
+    :param matrix: List of (league, country, season) tuples
+    :param root: Output directory holding every dataset, defaults to the
+                 script's OUTPUT_PATH
+    :param processes: Number of worker processes
+    :param max_workers: Number of fixtures each process fetches at the same
+                        time
+    :param requests_per_minute: Rate limit shared by every process, defaults
+                                to the script's FAPI_REQUESTS_PER_MINUTE
+    :param force: Sync complete partitions again
+
+    :return state: Dictionary of partition key to its latest outcome
+    """
+    script = load_script(FIXTURE_SCRIPT)
+    if root is not None:
+        script.OUTPUT_PATH = root
+    root = script.OUTPUT_PATH
+    if requests_per_minute is None:
+        requests_per_minute = script.FAPI_REQUESTS_PER_MINUTE
+    state_file = os.path.join(root, STATE_FILE)
+    state = load_state(state_file)
+
+    league_ids = script.get_league_ids(script.connect_to_api(), matrix)
+    pending = [key for key in matrix
+               if force or not state.get(partition_key(*key),
+                                         {}).get('complete')]
+    if not pending:
+        return state
+
+    rate_limiter = SharedRateLimiter(requests_per_minute / 60,
+                                     burst=max_workers)
+    budget_lock = multiprocessing.Lock()
+    with shared_metrics().stage('backfill') as stage:
+        with ProcessPoolExecutor(max_workers=min(processes, len(pending)),
+                                 initializer=init_worker,
+                                 initargs=(rate_limiter,
+                                           budget_lock,
+                                           root)) as pool:
+            futures = {pool.submit(backfill_partition,
+                                   league,
+                                   country,
+                                   season,
+                                   league_ids[league, country, season],
+                                   max_workers): (league, country, season)
+                       for league, country, season in pending}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as error:  # E.g. the worker process died
+                    result = {'error': repr(error), 'complete': False}
+                if 'metrics' in result:
+                    shared_metrics().merge(result.pop('metrics'))
+                state[partition_key(*futures[future])] = result
+                script.save_json(state, state_file)
+        stage.rows = sum(state[partition_key(*key)].get('fetched', 0)
+                         for key in pending)
+
+    return state
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--root',
+                        default=load_script(FIXTURE_SCRIPT).OUTPUT_PATH,
+                        help='Output directory the partitions are written to')
+    parser.add_argument('--leagues',
+                        type=parse_league,
+                        nargs='+',
+                        default=[('Premier League', 'England')],
+                        help="Leagues as 'league:country'")
+    parser.add_argument('--seasons', type=int, nargs='+', required=True)
+    parser.add_argument('--processes', type=int, default=DEFAULT_PROCESSES)
+    parser.add_argument('--workers-per-process',
+                        type=int,
+                        default=WORKERS_PER_PROCESS)
+    parser.add_argument('--requests-per-minute', type=float)
+    parser.add_argument('--force',
+                        action='store_true',
+                        help='Sync partitions that are already complete')
+    args = parser.parse_args()
+
+    matrix = league_matrix(args.leagues, args.seasons)
+    try:
+        backfill_state = run_backfill(
+            matrix,
+            root=args.root,
+            processes=args.processes,
+            max_workers=args.workers_per_process,
+            requests_per_minute=args.requests_per_minute,
+            force=args.force
+        )
+    finally:
+        shared_metrics().save(args.root, 'backfill')
+    for key in matrix:
+        result = backfill_state.get(partition_key(*key), {})
+        status = ('complete' if result.get('complete')
+                  else 'failed: ' + result['error'] if 'error' in result
+                  else '{} deferred'.format(result.get('deferred', 0)))
+        print('{:<40} {}'.format(partition_key(*key), status))
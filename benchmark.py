@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+
+Benchmarking the processing stages on synthetic data
+
+Synthetic football api fixtures (from mock_api_server's payloads) and FPL
+histories are generated for each combination of season and league counts,
+and each stage is timed and memory profiled:
+
+    fixture_normalise     json decode, json_normalize and Parquet write of
+                          every fixture's players (get_player_data)
+    fixtures_decode       streamed decode of each season's fixtures payload
+                          down to FIXTURE_FIELDS (get_fixtures)
+    history_merge         the merges in fetch_and_save_history
+    name_normalise        NameNormaliser over both name columns
+    combination_matching  match_variants of the FPL names
+    name_replacement      apply_name_corrections over both name columns
+    reconcile             reconcile on the in-memory frames
+
+Times are the best of --repeat runs. Peak memory comes from one extra run
+under tracemalloc, which sees Python and numpy allocations but not arrow's.
+Results are written as json with the git commit, so runs can be compared
+across commits with --compare.
+
+"""
+
+__author__ = 'Micah Cearns'
+__contact__ = 'micahcearns@gmail.com'
+__date__ = 'August 2020'
+
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+
+import mock_api_server as mock
+from json_stream import iter_arrays, read_chunks
+from name_matching import (NameNormaliser, apply_name_corrections,
+                           load_name_corrections, match_variants)
+from pipeline import load_script
+from reconcile import reconcile
+from storage import compact_dtypes, dataset_path, read_dataset
+
+FIXTURE_SCRIPT = '01_Get_FAPI_Player_Fixture_Data'
+HISTORY_SCRIPT = '02_Get_FPL_History'
+
+RESULTS_PATH = 'benchmark_results'
+DEFAULT_SEASONS = [1, 5, 20]
+DEFAULT_LEAGUES = [1, 10]
+DEFAULT_REPEAT = 3
+FPL_ELEMENTS = 600  # FPL only covers the Premier League
+
+
+def measure(func, repeat=DEFAULT_REPEAT):
+    """
+
+    Time func and record its peak traced memory
+
+    :param func: Callable taking no arguments
+    :param repeat: Number of timed runs, the fastest is kept
+
+    :return result: Return value of the last run of func
+    :return seconds: Fastest run time
+    :return peak_bytes: Peak memory traced during one more run
+    """
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak_bytes
+
+
+def league_seasons(n_seasons, n_leagues):
+    """ Synthetic leagues of the latest n_seasons of the first n_leagues """
+    leagues = mock.LEAGUES[:n_leagues]
+    return [(league_id, name, country, season)
+            for league_id, name, country, season in mock.league_seasons()
+            if (name, country) in leagues
+            and season > mock.LAST_SEASON - n_seasons]
+
+
+def fixture_bodies(config, league_id):
+    """ Raw players/fixture response bodies of one league season """
+    return [json.dumps(mock.players_payload(config, league_id * 1000 + n))
+            .encode('utf-8')
+            for n in range(config.fixtures_per_league)]
+
+
+def benchmark_fixture_normalise(root, config, n_seasons, n_leagues, repeat):
+    """
+
+    Decode, normalise and write synthetic fixtures one league season at a
+    time, as get_player_data does
+
+    :return record: Benchmark record of the stage
+    :return player_df: Compacted football api player names of every season
+    """
+    fixtures = load_script(FIXTURE_SCRIPT)
+    seconds = 0
+    peak_bytes = 0
+    rows = 0
+    for league_id, name, country, season in league_seasons(n_seasons,
+                                                           n_leagues):
+        bodies = fixture_bodies(config, league_id)  # Not timed
+        path = dataset_path(root,
+                            'player_fixture',
+                            '{} {}'.format(country, name),
+                            season)
+
+        def write():
+            payloads = (json.loads(body) for body in bodies)
+            return fixtures.write_player_batches(
+                fixtures.iter_fixture_players(payloads), path
+            )
+
+        n_rows, league_seconds, league_peak = measure(write, repeat)
+        seconds += league_seconds
+        peak_bytes = max(peak_bytes, league_peak)
+        rows += n_rows
+
+    player_df = compact_dtypes(read_dataset(root,
+                                            'player_fixture',
+                                            columns=['event_id',
+                                                     'player_id',
+                                                     'player_name',
+                                                     'minutes_played',
+                                                     'goals.total',
+                                                     'goals.assists',
+                                                     'goals.saves']),
+                               'player_fixture')
+    return {'rows': rows,
+            'seconds': seconds,
+            'peak_bytes': peak_bytes}, player_df
+
+
+def benchmark_fixtures_decode(config, n_seasons, n_leagues, repeat):
+    """
+
+    Stream the fields get_fixtures keeps out of synthetic fixtures payloads
+
+    :return record: Benchmark record of the stage
+    """
+    fields = load_script(FIXTURE_SCRIPT).FIXTURE_FIELDS
+    bodies = [json.dumps(mock.fixtures_payload(config, league_id))
+              .encode('utf-8')
+              for league_id, _, _, _ in league_seasons(n_seasons, n_leagues)]
+
+    def decode():
+        rows = 0
+        for body in bodies:
+            fixtures = iter_arrays(read_chunks(io.BytesIO(body)),
+                                   ('api',),
+                                   {'fixtures'})
+            rows += len([[fixture.get(field) for field in fields]
+                         for _, fixture in fixtures])
+        return rows
+
+    rows, seconds, peak_bytes = measure(decode, repeat)
+    return {'rows': rows, 'seconds': seconds, 'peak_bytes': peak_bytes}
+
+
+def benchmark_history_merge(config, n_seasons, repeat):
+    """
+
+    Merge synthetic FPL histories with the player info and positions
+
+    :return record: Benchmark record of the stage
+    :return fpl_df: The merged FPL history
+    """
+    history = load_script(HISTORY_SCRIPT)
+    history_config = mock.MockConfig(**{**vars(config),
+                                        'history_seasons': n_seasons,
+                                        'fpl_elements': FPL_ELEMENTS})
+    scores = pd.DataFrame([
+        row
+        for element_id in range(1, FPL_ELEMENTS + 1)
+        for row in mock.element_summary_payload(history_config,
+                                                element_id)['history_past']
+    ])
+    snapshot = history.build_bootstrap_snapshot(
+        mock.bootstrap_payload(history_config),
+        datetime.now(timezone.utc)
+    )
+    players = history.fetch_player_info(snapshot)
+    positions = history.fetch_positions(snapshot)
+
+    fpl_df, seconds, peak_bytes = measure(
+        lambda: history.build_history(scores, players, positions), repeat
+    )
+    fpl_df = compact_dtypes(fpl_df, 'fpl_history')
+    return {'rows': len(fpl_df),
+            'seconds': seconds,
+            'peak_bytes': peak_bytes}, fpl_df
+
+
+def benchmark_names(player_df, fpl_df, repeat):
+    """
+
+    Time the name cleaning and matching stages of 03_Clean_Player_Data.py
+
+    :return records: Dictionary of stage name to benchmark record
+    """
+    rows = len(player_df) + len(fpl_df)
+    corrections = load_name_corrections()
+
+    def normalise():
+        normaliser = NameNormaliser()  # No memo, every name is new
+        return (normaliser.normalise(player_df['player_name']),
+                normaliser.normalise(fpl_df['full_name']))
+
+    def replace():
+        return (apply_name_corrections(fapi_names, corrections['fapi']),
+                apply_name_corrections(fpl_names, corrections['fpl']))
+
+    stages = {}
+    (fapi_names, fpl_names), seconds, peak_bytes = measure(normalise, repeat)
+    stages['name_normalise'] = (rows, seconds, peak_bytes)
+
+    _, seconds, peak_bytes = measure(
+        lambda: match_variants(fpl_names, fapi_names), repeat
+    )
+    stages['combination_matching'] = (len(fpl_names), seconds, peak_bytes)
+
+    _, seconds, peak_bytes = measure(replace, repeat)
+    stages['name_replacement'] = (rows, seconds, peak_bytes)
+
+    _, seconds, peak_bytes = measure(
+        lambda: reconcile(player_df,
+                          fpl_df.dropna(subset=['full_name']),
+                          corrections=corrections),
+        repeat
+    )
+    stages['reconcile'] = (rows, seconds, peak_bytes)
+
+    return {stage: {'rows': rows, 'seconds': seconds, 'peak_bytes': peak}
+            for stage, (rows, seconds, peak) in stages.items()}
+
+
+def run_benchmarks(seasons, leagues, config, repeat=DEFAULT_REPEAT):
+    """
+
+    Benchmark every stage at every combination of season and league counts
+
+    :param seasons: List of season counts
+    :param leagues: List of league counts
+    :param config: MockConfig setting the payload sizes
+    :param repeat: Number of timed runs of each stage
+
+    :return results: List of benchmark records with stage, seasons, leagues,
+                     rows, seconds, rows_per_second and peak_bytes keys
+    """
+    results = []
+    for n_seasons, n_leagues in itertools.product(seasons, leagues):
+        with tempfile.TemporaryDirectory() as root:
+            fixture_record, player_df = benchmark_fixture_normalise(
+                root, config, n_seasons, n_leagues, repeat
+            )
+            records = {'fixture_normalise': fixture_record}
+            records['fixtures_decode'] = benchmark_fixtures_decode(
+                config, n_seasons, n_leagues, repeat
+            )
+            history_record, fpl_df = benchmark_history_merge(config,
+                                                             n_seasons,
+                                                             repeat)
+            records['history_merge'] = history_record
+            records.update(benchmark_names(player_df, fpl_df, repeat))
+
+        for stage, record in records.items():
+            record = {'stage': stage,
+                      'seasons': n_seasons,
+                      'leagues': n_leagues,
+                      **record}
+            record['rows_per_second'] = (record['rows'] / record['seconds']
+                                         if record['seconds'] else None)
+            results.append(record)
+            print('{stage:<22} {seasons:>3} seasons {leagues:>3} leagues '
+                  '{rows:>9} rows {seconds:9.3f}s {peak_bytes:>12} bytes'
+                  .format(**record))
+    return results
+
+
+def git_commit():
+    """ Current commit and whether the tree has changes, None outside git """
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                                cwd=here,
+                                capture_output=True,
+                                text=True,
+                                check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain'],
+                                cwd=here,
+                                capture_output=True,
+                                text=True,
+                                check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def save_results(results, config, repeat, results_path=RESULTS_PATH):
+    """
+
+    Write benchmark results, with what they were run on, to a json file
+
+    :return results_file: Path of the written file
+    """
+    commit, dirty = git_commit()
+    started = datetime.now(timezone.utc)
+    report = {'commit': commit,
+              'dirty': dirty,
+              'run_at': started.isoformat(),
+              'python': platform.python_version(),
+              'pandas': pd.__version__,
+              'pyarrow': pa.__version__,
+              'platform': platform.platform(),
+              'cpu_count': os.cpu_count(),
+              'repeat': repeat,
+              'config': vars(config),
+              'results': results}
+    os.makedirs(results_path, exist_ok=True)
+    results_file = os.path.join(
+        results_path,
+        '{}_{}.json'.format(started.strftime('%Y%m%dT%H%M%SZ'),
+                            (commit or 'nogit')[:10])
+    )
+    with open(results_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    return results_file
+
+
+def compare_results(baseline_file, results_file):
+    """
+
+    Put two benchmark runs side by side
+
+    :param baseline_file: Results json to compare against
+    :param results_file: Results json of the new run
+
+    :return comparison: Pandas dataframe of seconds and peak_bytes from both
+                        runs, with their ratios (below 1 is an improvement)
+    """
+    key = ['stage', 'seasons', 'leagues']
+    runs = []
+    for file in (baseline_file, results_file):
+        with open(file) as f:
+            runs.append(pd.DataFrame(json.load(f)['results'])
+                        .set_index(key)[['seconds', 'peak_bytes']])
+    comparison = runs[0].join(runs[1],
+                              lsuffix='_baseline',
+                              rsuffix='_new',
+                              how='outer')
+    for column in ('seconds', 'peak_bytes'):
+        comparison[column + '_ratio'] = (comparison[column + '_new']
+                                         / comparison[column + '_baseline'])
+    return comparison
+
+
+if __name__ == '__main__':
+    defaults = mock.MockConfig()
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--seasons', type=int, nargs='+',
+                        default=DEFAULT_SEASONS)
+    parser.add_argument('--leagues', type=int, nargs='+',
+                        default=DEFAULT_LEAGUES)
+    parser.add_argument('--fixtures-per-league', type=int,
+                        default=defaults.fixtures_per_league)
+    parser.add_argument('--players-per-team', type=int,
+                        default=defaults.players_per_team)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--results-path', default=RESULTS_PATH)
+    parser.add_argument('--compare',
+                        metavar='BASELINE',
+                        help='Results json to compare this run against')
+    args = parser.parse_args()
+
+    benchmark_config = mock.MockConfig(
+        fixtures_per_league=args.fixtures_per_league,
+        players_per_team=args.players_per_team
+    )
+    benchmark_results = run_benchmarks(args.seasons,
+                                       args.leagues,
+                                       benchmark_config,
+                                       repeat=args.repeat)
+    saved_file = save_results(benchmark_results,
+                              benchmark_config,
+                              args.repeat,
+                              results_path=args.results_path)
+    print(saved_file)
+    if args.compare:
+        print(compare_results(args.compare, saved_file))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+
+Persistent crosswalk between FPL and football api player ids
+
+Once a player has been matched their ids are stored, so later runs only need
+to match players that have not been seen before.
+
+"""
+
+__author__ = 'Micah Cearns'
+__contact__ = 'micahcearns@gmail.com'
+__date__ = 'August 2020'
+
+import os
+
+import pandas as pd
+
+from storage import SCHEMAS, dataset_path, read_dataset, write_dataset
+
+CROSSWALK_DATASET = 'player_crosswalk'
+CROSSWALK_COLUMNS = ['fpl_player_id',
+                     'fapi_player_id',
+                     'fpl_name',
+                     'fapi_name',
+                     'method']
+
+
+def load_crosswalk(root):
+    """
+
+    Load the stored crosswalk
+
+    :param root: Output directory holding every dataset
+
+    :return crosswalk: Pandas dataframe of CROSSWALK_COLUMNS, empty on the
+                       first run
+    """
+    if not os.path.exists(dataset_path(root, CROSSWALK_DATASET)):
+        return (SCHEMAS[CROSSWALK_DATASET].empty_table().to_pandas()
+                [CROSSWALK_COLUMNS])
+    return read_dataset(root, CROSSWALK_DATASET, columns=CROSSWALK_COLUMNS)
+
+
+def split_known_players(crosswalk, fpl_df, player_df):
+    """
+
+    Separate players already in the crosswalk from those still to be matched
+
+    :param crosswalk: Crosswalk dataframe from load_crosswalk
+    :param fpl_df: FPL dataframe with a player_id column
+    :param player_df: Football api dataframe with a player_id column
+
+    :return new_fpl_df: FPL rows whose player_id is not in the crosswalk
+    :return new_player_df: Football api rows whose player_id is not in the
+                           crosswalk
+    """
+    new_fpl_df = fpl_df.loc[~fpl_df['player_id']
+                            .isin(crosswalk['fpl_player_id'])]
+    new_player_df = player_df.loc[~player_df['player_id']
+                                  .isin(crosswalk['fapi_player_id'])]
+    return new_fpl_df, new_player_df
+
+
+def confirmed_matches(fpl_df, player_df, method='parsed_name'):
+    """
+
+    Pair up players whose parsed_full_name is identical in both dataframes
+
+    A name shared by more than one player on either side is ambiguous, so
+    only one-to-one pairs are returned.
+
+    :param fpl_df: FPL dataframe with player_id, full_name and
+                   parsed_full_name columns
+    :param player_df: Football api dataframe with player_id, player_name and
+                      parsed_full_name columns
+    :param method: Label recorded against each match
+
+    :return matches: Pandas dataframe of CROSSWALK_COLUMNS
+    """
+    fpl_names = (fpl_df[['player_id', 'full_name', 'parsed_full_name']]
+                 .drop_duplicates('player_id')
+                 .rename(columns={'player_id': 'fpl_player_id',
+                                  'full_name': 'fpl_name'}))
+    fapi_names = (player_df[['player_id', 'player_name', 'parsed_full_name']]
+                  .drop_duplicates('player_id')
+                  .rename(columns={'player_id': 'fapi_player_id',
+                                   'player_name': 'fapi_name'}))
+    fpl_names['parsed_full_name'] = fpl_names['parsed_full_name'].astype(str)
+    fapi_names['parsed_full_name'] = fapi_names['parsed_full_name'].astype(str)
+
+    matches = fpl_names.merge(fapi_names, on='parsed_full_name')
+    one_to_one = (~matches['fpl_player_id'].duplicated(keep=False)
+                  & ~matches['fapi_player_id'].duplicated(keep=False))
+    matches = matches.loc[one_to_one].assign(method=method)
+    return matches[CROSSWALK_COLUMNS].reset_index(drop=True)
+
+
+def update_crosswalk(root, crosswalk, matches):
+    """
+
+    Add newly confirmed matches to the crosswalk and save it
+
+    :param root: Output directory holding every dataset
+    :param crosswalk: Crosswalk dataframe from load_crosswalk
+    :param matches: New matches from confirmed_matches
+
+    :return crosswalk: The updated crosswalk
+    """
+    new = matches.loc[~matches['fpl_player_id']
+                      .isin(crosswalk['fpl_player_id'])
+                      & ~matches['fapi_player_id']
+                      .isin(crosswalk['fapi_player_id'])]
+    if new.empty:
+        return crosswalk
+
+    crosswalk = (new.reset_index(drop=True) if crosswalk.empty
+                 else pd.concat([crosswalk, new], ignore_index=True))
+    crosswalk['fpl_player_id'] = crosswalk['fpl_player_id'].astype('int64')
+    crosswalk['fapi_player_id'] = crosswalk['fapi_player_id'].astype('int64')
+    write_dataset(crosswalk, root, CROSSWALK_DATASET)
+    return crosswalk
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+
+Incremental decoding of the arrays inside large json documents
+
+The api payloads are objects wrapping a few big arrays, e.g. api.leagues or
+bootstrap-static's elements. Rather than decoding a whole payload, the bytes
+are walked chunk by chunk down to the wanted arrays, each array item is
+decoded on its own with json.JSONDecoder.raw_decode and everything else is
+skipped without being decoded, so memory scales with one item (plus whatever
+the caller keeps) rather than with the document.
+
+"""
+
+__author__ = 'Micah Cearns'
+__contact__ = 'micahcearns@gmail.com'
+__date__ = 'August 2020'
+
+import codecs
+import json
+import re
+
+CHUNK_SIZE = 64 * 1024  # Bytes read at a time
+COMPACT_AT = 4 * CHUNK_SIZE  # Characters consumed before the buffer is trimmed
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+CONTAINER_TOKEN = re.compile(r'["{}\[\]]')
+STRING_END = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+NUMBER_CHARACTERS = set('0123456789.eE+-')
+
+
+def read_chunks(file, chunk_size=CHUNK_SIZE):
+    """ Chunks of an open binary file """
+    return iter(lambda: file.read(chunk_size), b'')
+
+
+class JsonStream:
+    """
+
+    Buffered cursor over json text arriving in byte chunks
+
+    :param chunks: Iterable of bytes, e.g. read_chunks(file) or a response's
+                   iter_content()
+
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.exhausted = False
+
+    def more(self):
+        """ Append the next chunk to the buffer, False at the end """
+        if self.exhausted:
+            return False
+        if self.pos > COMPACT_AT:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.exhausted = True
+            self.buffer += self.utf8.decode(b'', final=True)
+        else:
+            self.buffer += self.utf8.decode(chunk)
+        return True
+
+    def error(self, message):
+        return json.JSONDecodeError(message, self.buffer, self.pos)
+
+    def peek(self):
+        """ Next character after any whitespace, '' at the end """
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.more():
+                return ''
+
+    def expect(self, characters):
+        """ Consume the next character, which must be one of characters """
+        character = self.peek()
+        if not character or character not in characters:
+            raise self.error('Expected one of {!r}'.format(characters))
+        self.pos += 1
+        return character
+
+    def decode(self):
+        """ Decode the next value """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.more():
+                    raise
+                continue
+            # A number cut off by the end of the chunk decodes as a shorter one
+            if ((end < len(self.buffer)
+                 and self.buffer[end] not in NUMBER_CHARACTERS)
+                    or not self.more()):
+                self.pos = end
+                return value
+
+    def skip(self):
+        """ Move past the next value without decoding it """
+        if self.peek() not in '{[':
+            self.decode()  # Scalars are small
+            return
+        depth = 0
+        while True:
+            match = CONTAINER_TOKEN.search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                if not self.more():
+                    raise self.error('Unterminated value')
+                continue
+            if match.group() == '"':
+                end = STRING_END.match(self.buffer, match.end())
+                if end is None:  # The string continues in the next chunk
+                    self.pos = match.start()
+                    if not self.more():
+                        raise self.error('Unterminated string')
+                    continue
+                self.pos = end.end()
+                continue
+            self.pos = match.end()
+            depth += 1 if match.group() in '{[' else -1
+            if depth == 0:
+                return
+
+    def members(self):
+        """ Keys of the object at the cursor, each value left to the caller """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def items(self):
+        """ Decoded items of the array starting at the cursor """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.expect(',]') == ']':
+                return
+
+
+def iter_arrays(chunks, path, keys):
+    """
+
+    Decode the items of some arrays in a json document one at a time
+
+    :param chunks: Iterable of bytes of the document
+    :param path: Keys leading from the top-level object to the object holding
+                 the arrays, e.g. ('api',), empty for the top level
+    :param keys: Keys of the arrays wanted in that object, e.g. {'leagues'}
+
+    :return items: Generator of (key, item) pairs in document order
+    """
+    stream = JsonStream(chunks)
+    for step in path:
+        for key in stream.members():
+            if key == step:
+                break
+            stream.skip()
+        else:
+            raise KeyError(step)
+
+    for key in stream.members():
+        if key in keys and stream.peek() == '[':
+            for item in stream.items():
+                yield key, item
+        else:
+            stream.skip()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+
+Run metrics for the fetching and cleaning scripts
+
+Stages record their wall time, peak memory and row counts, and get_json and
+iter_json record every request per endpoint: requests by status, bytes,
+latency, cache hits, retries and time spent waiting on rate limits. At the
+end of a run the metrics are written as a json report and in the Prometheus
+text format, e.g. for node_exporter's textfile collector.
+
+"""
+
+__author__ = 'Micah Cearns'
+__contact__ = 'micahcearns@gmail.com'
+__date__ = 'August 2020'
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+METRICS_PATH = os.environ.get('EPL_METRICS_PATH')  # Overrides METRICS_DIR
+METRICS_DIR = 'metrics'  # Directory in each script's output path
+TRACE_MEMORY = os.environ.get('EPL_TRACE_MEMORY', '0') == '1'
+METRIC_PREFIX = 'epl'
+
+STAGE_HELP = {'seconds': 'Stage wall time',
+              'rows': 'Rows the stage produced',
+              'peak_traced_bytes': 'Peak traced memory during the stage',
+              'max_rss_bytes': 'Peak resident memory when the stage ended'}
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf')]
+
+
+def endpoint(url):
+    """ Endpoint label of a url with ids replaced, e.g. /v2/leagues/{id} """
+    return re.sub(r'/\d+', '/{id}', urlsplit(url).path)
+
+
+def max_rss_bytes():
+    """ Peak resident memory of the process so far, None where unknown """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024  # KiB
+
+
+class StageRecord:
+    """ Metrics of one stage, callers set rows once they know it """
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.seconds = None
+        self.peak_traced_bytes = None
+        self.max_rss_bytes = None
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class EndpointStats:
+    """ Request counters and latency histogram of one endpoint """
+
+    def __init__(self):
+        self.requests = defaultdict(int)  # status code -> count
+        self.cache_hits = 0
+        self.retries = 0
+        self.wait_seconds = 0.0  # Spent waiting on client-side rate limits
+        self.bytes = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)  # Not cumulative
+
+    def as_dict(self):
+        return {'requests': {str(status): count
+                             for status, count in self.requests.items()},
+                'cache_hits': self.cache_hits,
+                'retries': self.retries,
+                'wait_seconds': self.wait_seconds,
+                'bytes': self.bytes,
+                'latency_sum': self.latency_sum,
+                'latency_buckets': dict(zip(map(str, LATENCY_BUCKETS),
+                                            self.latency_buckets))}
+
+
+class Metrics:
+    """
+
+    Thread-safe collection of one run's stage and request metrics
+
+    Peak traced memory is only recorded when tracemalloc is running, see
+    TRACE_MEMORY. It is process wide, so stages running at the same time
+    share their peaks, and before Python 3.9 each stage's peak is the peak of
+    the run so far.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = datetime.now(timezone.utc)
+        self.stages = []
+        self.endpoints = defaultdict(EndpointStats)
+        if TRACE_MEMORY and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        """
+
+        Record a stage's wall time and memory
+
+        :param name: Stage name
+
+        :return record: StageRecord to set rows on
+        """
+        record = StageRecord(name)
+        # reset_peak is new in Python 3.9, before it peaks are run-wide
+        if tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+            if tracemalloc.is_tracing():
+                record.peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+            record.max_rss_bytes = max_rss_bytes()
+            with self.lock:
+                self.stages.append(record)
+
+    def record_request(self, url, status, seconds, n_bytes):
+        """ Record a request sent to the api """
+        bucket = next(i for i, bound in enumerate(LATENCY_BUCKETS)
+                      if seconds <= bound)
+        with self.lock:
+            stats = self.endpoints[endpoint(url)]
+            stats.requests[status] += 1
+            stats.bytes += n_bytes
+            stats.latency_sum += seconds
+            stats.latency_buckets[bucket] += 1
+
+    def record_cache_hit(self, url):
+        """ Record a request answered from the response cache """
+        with self.lock:
+            self.endpoints[endpoint(url)].cache_hits += 1
+
+    def record_wait(self, url, seconds):
+        """ Record time a request waited on a client-side rate limiter """
+        with self.lock:
+            self.endpoints[endpoint(url)].wait_seconds += seconds
+
+    def record_retry(self, url):
+        """ Record a request that is about to be retried """
+        with self.lock:
+            self.endpoints[endpoint(url)].retries += 1
+
+    def merge(self, report):
+        """
+
+        Add the stages and requests of a report, e.g. one sent back by a
+        worker process, whose shared metrics the parent cannot see
+
+        :param report: Dictionary from Metrics.report
+        """
+        with self.lock:
+            for stage in report['stages']:
+                record = StageRecord(stage['name'])
+                vars(record).update(stage)
+                self.stages.append(record)
+            for name, stats in report['endpoints'].items():
+                totals = self.endpoints[name]
+                for status, count in stats['requests'].items():
+                    totals.requests[int(status)] += count
+                totals.cache_hits += stats['cache_hits']
+                totals.retries += stats['retries']
+                totals.wait_seconds += stats['wait_seconds']
+                totals.bytes += stats['bytes']
+                totals.latency_sum += stats['latency_sum']
+                for i, count in enumerate(stats['latency_buckets'].values()):
+                    totals.latency_buckets[i] += count
+
+    def report(self, run):
+        """
+
+        Everything recorded so far
+
+        :param run: Name of the run, e.g. the script
+
+        :return report: Json-serialisable dictionary
+        """
+        with self.lock:
+            return {'run': run,
+                    'started_at': self.started_at.isoformat(),
+                    'finished_at': datetime.now(timezone.utc).isoformat(),
+                    'stages': [record.as_dict() for record in self.stages],
+                    'endpoints': {name: stats.as_dict()
+                                  for name, stats in self.endpoints.items()}}
+
+    def prometheus(self, run):
+        """
+
+        Everything recorded so far in the Prometheus text format
+
+        :param run: Name of the run, added as a run label
+
+        :return text: Prometheus exposition text
+        """
+        report = self.report(run)
+        metrics = defaultdict(list)  # (name, type, help) -> sample lines
+
+        def sample(metric, labels, value, suffix=''):
+            labels = dict(labels, run=run)
+            label_text = ','.join('{}="{}"'.format(key, str(value)
+                                                   .replace('\\', '\\\\')
+                                                   .replace('"', '\\"'))
+                                  for key, value in sorted(labels.items()))
+            metrics[metric].append('{}_{}{}{{{}}} {}'.format(
+                METRIC_PREFIX, metric[0], suffix, label_text, value
+            ))
+
+        # A stage run more than once is summed, keeping its highest peaks
+        stages = {}
+        for record in report['stages']:
+            totals = stages.setdefault(record['name'], {})
+            for key in ('seconds', 'rows'):
+                if record[key] is not None:
+                    totals[key] = totals.get(key, 0) + record[key]
+            for key in ('peak_traced_bytes', 'max_rss_bytes'):
+                if record[key] is not None:
+                    totals[key] = max(totals.get(key, 0), record[key])
+        for name, totals in stages.items():
+            for key, value in totals.items():
+                sample(('stage_' + key, 'gauge', STAGE_HELP[key]),
+                       {'stage': name}, value)
+
+        latency = ('http_request_duration_seconds', 'histogram',
+                   'Request latency')
+        for name, stats in report['endpoints'].items():
+            labels = {'endpoint': name}
+            for status, count in stats['requests'].items():
+                sample(('http_requests_total', 'counter',
+                        'Requests sent to the api'),
+                       dict(labels, status=status), count)
+            sample(('http_cache_hits_total', 'counter',
+                    'Requests answered from the response cache'),
+                   labels, stats['cache_hits'])
+            sample(('http_retries_total', 'counter', 'Requests retried'),
+                   labels, stats['retries'])
+            sample(('http_rate_limit_wait_seconds_total', 'counter',
+                    'Time spent waiting on client-side rate limits'),
+                   labels, stats['wait_seconds'])
+            sample(('http_response_bytes_total', 'counter',
+                    'Response bytes received'),
+                   labels, stats['bytes'])
+            cumulative = 0
+            for bound, count in stats['latency_buckets'].items():
+                cumulative += count
+                le = '+Inf' if float(bound) == float('inf') else bound
+                sample(latency, dict(labels, le=le), cumulative, '_bucket')
+            sample(latency, labels, stats['latency_sum'], '_sum')
+            sample(latency, labels, cumulative, '_count')
+
+        lines = []
+        for (metric, metric_type, help_text), samples in metrics.items():
+            name = '{}_{}'.format(METRIC_PREFIX, metric)
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            lines += samples
+        return '\n'.join(lines) + '\n'
+
+    def save(self, root, run):
+        """
+
+        Write the json report and the Prometheus text file
+
+        :param root: Output directory, the files go in its METRICS_DIR unless
+                     METRICS_PATH is set
+        :param run: Name of the run, used in the file names
+
+        :return report_file: Path of the json report
+        :return prometheus_file: Path of the Prometheus text file
+        """
+        path = METRICS_PATH or os.path.join(root, METRICS_DIR)
+        os.makedirs(path, exist_ok=True)
+        report_file = os.path.join(path, '{}_metrics.json'.format(run))
+        prometheus_file = os.path.join(path, '{}.prom'.format(run))
+        for file, text in ((report_file,
+                            json.dumps(self.report(run), indent=2)),
+                           (prometheus_file, self.prometheus(run))):
+            tmp_file = file + '.tmp'  # Scrapers never see half a file
+            with open(tmp_file, 'w') as f:
+                f.write(text)
+            os.replace(tmp_file, file)
+        return report_file, prometheus_file
+
+
+shared_metrics_lock = threading.Lock()
+shared_metrics_instance = None
+
+
+def shared_metrics():
+    """ Metrics shared by every stage and request in the process """
+    global shared_metrics_instance
+    with shared_metrics_lock:
+        if shared_metrics_instance is None:
+            shared_metrics_instance = Metrics()
+        return shared_metrics_instance
+
+
+def reset_shared_metrics():
+    """ Start the shared metrics afresh, returning the ones replaced """
+    global shared_metrics_instance
+    with shared_metrics_lock:
+        metrics = shared_metrics_instance
+        shared_metrics_instance = Metrics()
+        return metrics
@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+
+Local stand-in for the football api and the official EPL api
+
+Serves synthetic (or recorded) payloads for the endpoints the fetchers use,
+with configurable latency, jitter, 429 responses and payload sizes. Point the
+fetchers at it with
+
+    FAPI_BASE_URL=http://localhost:8000/v2
+    FPL_BASE_URL=http://localhost:8000/api
+
+and a throwaway EPL_CACHE_PATH, so responses are not replayed from the
+response cache. Synthetic payloads are generated from the ids in the url, so
+every run serves the same data.
+
+"""
+
+__author__ = 'Micah Cearns'
+__contact__ = 'micahcearns@gmail.com'
+__date__ = 'August 2020'
+
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LEAGUES = [('Premier League', 'England'),
+           ('Primera Division', 'Spain'),
+           ('Serie A', 'Italy'),
+           ('Bundesliga 1', 'Germany'),
+           ('Ligue 1', 'France'),
+           ('Eredivisie', 'Netherlands'),
+           ('Primeira Liga', 'Portugal'),
+           ('Premiership', 'Scotland'),
+           ('Jupiler Pro League', 'Belgium'),
+           ('Super Lig', 'Turkey')]
+FIRST_SEASON = 2000
+LAST_SEASON = 2020
+TEAMS_PER_LEAGUE = 20
+SEASON_START = 1565395200  # 10 August 2019
+DAYS_BETWEEN_FIXTURES = 0.1
+FPL_LEAGUE_ID = 1000 + 2019 - FIRST_SEASON  # Premier League 2019 players
+CUP_LEAGUE_ID = 9999  # Competition every team also plays in
+
+# Accents, dashes and particles, as in the real names
+FIRST_NAMES = ['Heung-Min', 'Kevin', 'Mohamed', 'Raúl', 'Martin', 'Bernardo',
+               'Çağlar', 'João', 'Lucas', 'Rúben', 'Jordan', 'Harry',
+               'Jamie', 'Sadio', 'Pierre-Emerick', 'Wilfred', 'Jack', 'Ben',
+               'Luka', 'Sergio', 'Adama', 'Emiliano', 'Ederson', 'Rodrigo']
+LAST_NAMES = ['Son', 'De Bruyne', 'Salah', 'Jiménez', 'Ødegaard', 'Silva',
+              'Söyüncü', 'Moutinho', 'Moura', 'Dias', 'Henderson', 'Kane',
+              'Vardy', 'Mané', 'Aubameyang', 'Ndidi', 'Grealish', 'Mee',
+              'Modrić', 'Agüero', 'Traoré', 'Martínez', 'de Moraes',
+              'Hernández']
+MIDDLE_NAMES = ['Santos', 'Rodrigues', 'Luiz', 'Borges']
+POSITIONS = ['G', 'D', 'M', 'F']
+FPL_POSITIONS = ['Goalkeeper', 'Defender', 'Midfielder', 'Forward']
+
+
+@dataclass
+class MockConfig:
+    """ Behaviour and payload sizes of the mock server """
+    latency: float = 0.05  # Seconds added to every response
+    jitter: float = 0.02  # Latency varies uniformly by up to this much
+    rate_limit_probability: float = 0.0  # Chance of a 429 response
+    retry_after: int = 1  # Retry-After seconds sent with a 429
+    fixtures_per_league: int = 380  # At most 1000
+    finished_fraction: float = 1.0  # Fixtures with statusShort 'FT'
+    players_per_team: int = 16  # Players in each side of a fixture
+    fpl_elements: int = 600  # Players in bootstrap-static
+    history_seasons: int = 3  # Past seasons in each element-summary
+    recorded_path: str = None  # Directory of recorded payloads
+
+
+def league_seasons():
+    """ (league_id, name, country, season) of every synthetic league """
+    rows = []
+    for i, (name, country) in enumerate(LEAGUES):
+        for season in range(FIRST_SEASON, LAST_SEASON + 1):
+            league_id = 1000 + 100 * i + season - FIRST_SEASON
+            rows.append((league_id, name, country, season))
+    return rows
+
+
+def player_name(player_id, middle_names=False):
+    """ Name of a synthetic player, the same for a player_id every time """
+    rng = random.Random(player_id)
+    names = [rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)]
+    if rng.random() < 0.5:  # Double barrelled, so names rarely repeat
+        names.append(rng.choice(LAST_NAMES))
+    if middle_names and rng.random() < 0.3:
+        names.insert(1, rng.choice(MIDDLE_NAMES))
+    return ' '.join(names)
+
+
+def team_id(league_id, team):
+    """ Football api id of team number team in a league season """
+    return league_id * 100 + team
+
+
+def leagues_payload(config):
+    """ /v2/leagues """
+    leagues = [{'league_id': league_id,
+                'name': name,
+                'type': 'League',
+                'country': country,
+                'country_code': country[:2].upper(),
+                'season': season,
+                'season_start': '{}-08-10'.format(season),
+                'season_end': '{}-05-20'.format(season + 1),
+                'is_current': int(season == LAST_SEASON)}
+               for league_id, name, country, season in league_seasons()]
+    return {'api': {'results': len(leagues), 'leagues': leagues}}
+
+
+def fixture_teams(fixture_id):
+    """ Home and away team numbers of a fixture """
+    n = fixture_id % 1000
+    home = n % TEAMS_PER_LEAGUE
+    away = (home + 1 + n // TEAMS_PER_LEAGUE) % TEAMS_PER_LEAGUE
+    if away == home:
+        away = (home + 1) % TEAMS_PER_LEAGUE
+    return home, away
+
+
+def fixtures_payload(config, league_id):
+    """ /v2/fixtures/league/{league_id} """
+    n_finished = int(config.fixtures_per_league * config.finished_fraction)
+    fixtures = []
+    for n in range(config.fixtures_per_league):
+        fixture_id = league_id * 1000 + n
+        home, away = fixture_teams(fixture_id)
+        timestamp = int(SEASON_START + n * DAYS_BETWEEN_FIXTURES * 86400)
+        fixtures.append({
+            'fixture_id': fixture_id,
+            'league_id': league_id,
+            'event_date': time.strftime('%Y-%m-%dT%H:%M:%S+00:00',
+                                        time.gmtime(timestamp)),
+            'event_timestamp': timestamp,
+            'round': 'Regular Season - {}'.format(n // 10 + 1),
+            'statusShort': 'FT' if n < n_finished else 'NS',
+            'homeTeam': {'team_id': team_id(league_id, home),
+                         'team_name': 'Team {}'.format(home)},
+            'awayTeam': {'team_id': team_id(league_id, away),
+                         'team_name': 'Team {}'.format(away)},
+        })
+    return {'api': {'results': len(fixtures), 'fixtures': fixtures}}
+
+
+def fixture_player(rng, fixture_id, team, number):
+    """ One player's stats for a fixture, as the football api sends them """
+    player_id = team * 100 + number
+    minutes = rng.choice([0, 15, 45, 60, 90, 90, 90])
+
+    def stat(high):
+        return rng.randint(0, high) if minutes else None
+
+    return {
+        'event_id': fixture_id,
+        'updateAt': SEASON_START,
+        'player_id': player_id,
+        'player_name': player_name(player_id),
+        'team_id': team,
+        'team_name': 'Team {}'.format(team % 100),
+        'number': number,
+        'position': POSITIONS[min(number // 4, 3)],
+        'rating': '{:.1f}'.format(rng.uniform(5, 9)) if minutes else '–',
+        'minutes_played': minutes,
+        'captain': 'True' if number == 1 else 'False',
+        'substitute': 'True' if number > 11 else 'False',
+        'offsides': stat(2),
+        'shots': {'total': stat(5), 'on': stat(3)},
+        'goals': {'total': stat(1),
+                  'conceded': stat(3),
+                  'assists': stat(1),
+                  'saves': stat(5) if number == 0 else 0},
+        'passes': {'total': stat(80), 'key': stat(4), 'accuracy': stat(100)},
+        'tackles': {'total': stat(5), 'blocks': stat(2),
+                    'interceptions': stat(3)},
+        'duels': {'total': stat(20), 'won': stat(10)},
+        'dribbles': {'attempts': stat(5), 'success': stat(3), 'past': stat(2)},
+        'fouls': {'drawn': stat(3), 'committed': stat(3)},
+        'cards': {'yellow': stat(1), 'red': 0},
+        'penalty': {'won': 0, 'commited': 0, 'success': 0, 'missed': 0,
+                    'saved': 0},
+    }
+
+
+def players_payload(config, fixture_id):
+    """ /v2/players/fixture/{fixture_id} """
+    rng = random.Random(fixture_id)
+    league_id = fixture_id // 1000
+    players = [fixture_player(rng, fixture_id, team_id(league_id, team), n)
+               for team in fixture_teams(fixture_id)
+               for n in range(config.players_per_team)]
+    return {'api': {'results': len(players), 'players': players}}
+
+
+def teams_payload(config, league_id):
+    """ /v2/teams/league/{league_id} """
+    teams = [{'team_id': team_id(league_id, team),
+              'name': 'Team {}'.format(team)}
+             for team in range(TEAMS_PER_LEAGUE)]
+    return {'api': {'results': len(teams), 'teams': teams}}
+
+
+def team_players_payload(config, team, season, season_end):
+    """ /v2/players/team/{team_id}/{season}-{season_end} """
+    rng = random.Random(team)
+    league_id = team // 100
+    players = []
+    for number in range(config.players_per_team):
+        player_id = team * 100 + number
+        # The league and a cup, which the season mode has to filter out
+        for competition_id, games in ((league_id, 38), (CUP_LEAGUE_ID, 3)):
+            appearances = rng.randint(0, games)
+            players.append({
+                'player_id': player_id,
+                'player_name': player_name(player_id),
+                'team_id': team,
+                'team_name': 'Team {}'.format(team % 100),
+                'league_id': competition_id,
+                'season': '{}-{}'.format(season, season_end),
+                'position': POSITIONS[min(number // 4, 3)],
+                'games': {'appearences': appearances,
+                          'minutes_played': appearances * rng.randint(0, 90),
+                          'lineups': rng.randint(0, appearances)},
+                'goals': {'total': rng.randint(0, appearances // 2),
+                          'conceded': rng.randint(0, appearances),
+                          'assists': rng.randint(0, appearances // 3),
+                          'saves': (rng.randint(0, 3 * appearances)
+                                    if number == 0 else 0)},
+            })
+    return {'api': {'results': len(players), 'players': players}}
+
+
+def element_code(element_id):
+    """ FPL code of an element, used to join histories to players """
+    return 100000 + element_id
+
+
+def element_summary_payload(config, element_id):
+    """ /api/element-summary/{element_id}/ """
+    rng = random.Random(element_id)
+    history_past = []
+    for i in range(config.history_seasons):
+        season = LAST_SEASON - config.history_seasons + i
+        history_past.append({
+            'season_name': '{}/{:02d}'.format(season, (season + 1) % 100),
+            'element_code': element_code(element_id),
+            'start_cost': rng.randint(40, 120),
+            'end_cost': rng.randint(40, 120),
+            'total_points': rng.randint(0, 250),
+            'minutes': rng.randint(0, 3420),
+            'goals_scored': rng.randint(0, 25),
+            'assists': rng.randint(0, 15),
+            'clean_sheets': rng.randint(0, 15),
+            'goals_conceded': rng.randint(0, 60),
+            'own_goals': 0,
+            'penalties_saved': 0,
+            'penalties_missed': rng.randint(0, 2),
+            'yellow_cards': rng.randint(0, 10),
+            'red_cards': rng.randint(0, 1),
+            'saves': rng.randint(0, 100),
+            'bonus': rng.randint(0, 30),
+            'bps': rng.randint(0, 800),
+        })
+    return {'history_past': history_past, 'history': [], 'fixtures': []}
+
+
+def bootstrap_payload(config):
+    """ /api/bootstrap-static/ """
+    elements = []
+    for element_id in range(1, config.fpl_elements + 1):
+        rng = random.Random(-element_id)
+        # FPL players share their ids with the first football api league,
+        # and often carry a middle name the football api leaves out
+        team, number = divmod(element_id - 1, config.players_per_team)
+        team = team % TEAMS_PER_LEAGUE
+        fapi_id = team_id(FPL_LEAGUE_ID, team) * 100 + number
+        first_name, second_name = (player_name(fapi_id, middle_names=True)
+                                   .split(' ', 1))
+        elements.append({
+            'id': element_id,
+            'code': element_code(element_id),
+            'element_type': min(number // 4, 3) + 1,
+            'team': team + 1,
+            'team_code': team + 1,
+            'first_name': first_name,
+            'second_name': second_name,
+            'web_name': second_name,
+            'status': 'a',
+            'now_cost': rng.randint(40, 120),
+            'selected_by_percent': '{:.1f}'.format(rng.uniform(0, 60)),
+            'form': '{:.1f}'.format(rng.uniform(0, 10)),
+            'value_form': '{:.1f}'.format(rng.uniform(0, 2)),
+            'news': rng.choice(['', '', '', 'Knock - 75% chance of playing',
+                                'Joined Ajax on loan']),
+            'chance_of_playing_next_round': rng.choice([None, 75, 100]),
+            'minutes': rng.randint(0, 3420),
+            'goals_scored': rng.randint(0, 25),
+            'assists': rng.randint(0, 15),
+            'total_points': rng.randint(0, 250),
+        })
+    element_types = [{'id': i + 1,
+                      'singular_name': name,
+                      'singular_name_short': name[:3].upper(),
+                      'plural_name': name + 's',
+                      'squad_select': 5}
+                     for i, name in enumerate(FPL_POSITIONS)]
+    teams = [{'id': i + 1,
+              'code': i + 1,
+              'name': 'Team {}'.format(i),
+              'short_name': 'T{:02d}'.format(i),
+              'strength': 3}
+             for i in range(TEAMS_PER_LEAGUE)]
+    events = [{'id': i + 1,
+               'name': 'Gameweek {}'.format(i + 1),
+               'deadline_time': time.strftime(
+                   '%Y-%m-%dT%H:%M:%SZ',
+                   time.gmtime(SEASON_START + i * 7 * 86400)),
+               'finished': True,
+               'is_previous': False,
+               'is_current': False,
+               'is_next': False}
+              for i in range(38)]
+    return {'elements': elements,
+            'element_types': element_types,
+            'teams': teams,
+            'events': events}
+
+
+# (route name, url pattern, payload builder taking config and the url ids)
+ROUTES = [
+    ('leagues', re.compile(r'/v2/leagues/?$'), leagues_payload),
+    ('fixtures', re.compile(r'/v2/fixtures/league/(\d+)/?$'),
+     fixtures_payload),
+    ('players', re.compile(r'/v2/players/fixture/(\d+)/?$'), players_payload),
+    ('teams', re.compile(r'/v2/teams/league/(\d+)/?$'), teams_payload),
+    ('team_players', re.compile(r'/v2/players/team/(\d+)/(\d+)-(\d+)/?$'),
+     team_players_payload),
+    ('element_summary', re.compile(r'/api/element-summary/(\d+)/?$'),
+     element_summary_payload),
+    ('bootstrap_static', re.compile(r'/api/bootstrap-static/?$'),
+     bootstrap_payload),
+]
+
+
+def recorded_file(recorded_path, url_path):
+    """ Recorded payload file for url_path, e.g. <path>/v2/leagues.json """
+    return os.path.join(recorded_path, url_path.strip('/') + '.json')
+
+
+class MockApiHandler(BaseHTTPRequestHandler):
+    """ Serve one request, see MockApiServer for the behaviour """
+
+    def do_GET(self):
+        config = self.server.config
+        path = self.path.split('?', 1)[0]
+        for route, pattern, payload in ROUTES:
+            match = pattern.match(path)
+            if match:
+                break
+        else:
+            self.server.count('not_found')
+            return self.send_json(404, {'message': 'Unknown endpoint'})
+
+        delay = config.latency + random.uniform(-config.jitter, config.jitter)
+        time.sleep(max(delay, 0))
+
+        if random.random() < config.rate_limit_probability:
+            self.server.count(route + '_429')
+            return self.send_json(429,
+                                  {'message': 'Too many requests'},
+                                  {'Retry-After': str(config.retry_after)})
+
+        self.server.count(route)
+        if config.recorded_path:
+            file = recorded_file(config.recorded_path, path)
+            if os.path.exists(file):
+                with open(file, 'rb') as f:
+                    return self.send_body(200, f.read())
+        ids = [int(i) for i in match.groups()]
+        return self.send_json(200, payload(config, *ids))
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_body(status, body, headers)
+
+    def send_body(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class MockApiServer(ThreadingHTTPServer):
+    """
+
+    Threaded mock server, counting the requests served per route
+
+    :param address: (host, port) to listen on, port 0 picks a free port
+    :param config: MockConfig
+    :param verbose: Log every request
+
+    """
+
+    daemon_threads = True
+    request_queue_size = 128  # Room for every worker connecting at once
+
+    def __init__(self, address, config=None, verbose=False):
+        super().__init__(address, MockApiHandler)
+        self.config = config or MockConfig()
+        self.verbose = verbose
+        self.counts = Counter()
+        self.counts_lock = threading.Lock()
+
+    def count(self, route):
+        with self.counts_lock:
+            self.counts[route] += 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+
+def start_server(config=None, host='127.0.0.1', port=0):
+    """
+
+    Start a mock server in a background thread
+
+    :param config: MockConfig
+    :param host: Interface to listen on
+    :param port: Port to listen on, 0 picks a free port
+
+    :return server: Running MockApiServer, stop it with server.shutdown()
+    """
+    server = MockApiServer((host, port), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    defaults = MockConfig()
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=defaults.latency)
+    parser.add_argument('--jitter', type=float, default=defaults.jitter)
+    parser.add_argument('--rate-limit-probability',
+                        type=float,
+                        default=defaults.rate_limit_probability)
+    parser.add_argument('--retry-after',
+                        type=int,
+                        default=defaults.retry_after)
+    parser.add_argument('--fixtures-per-league',
+                        type=int,
+                        default=defaults.fixtures_per_league)
+    parser.add_argument('--finished-fraction',
+                        type=float,
+                        default=defaults.finished_fraction)
+    parser.add_argument('--players-per-team',
+                        type=int,
+                        default=defaults.players_per_team)
+    parser.add_argument('--fpl-elements',
+                        type=int,
+                        default=defaults.fpl_elements)
+    parser.add_argument('--history-seasons',
+                        type=int,
+                        default=defaults.history_seasons)
+    parser.add_argument('--recorded-path',
+                        help='Serve <path>/<url path>.json where it exists')
+    parser.add_argument('--verbose', action='store_true')
+    args = vars(parser.parse_args())
+
+    address = (args.pop('host'), args.pop('port'))
+    verbose = args.pop('verbose')
+    server = MockApiServer(address, MockConfig(**args), verbose=verbose)
+    print('Serving on {}'.format(server.base_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(dict(server.counts))
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+
+Matching player names between the football api and the official EPL api
+
+"""
+
+__author__ = 'Micah Cearns'
+__contact__ = 'micahcearns@gmail.com'
+__date__ = 'August 2020'
+
+import csv
+import json
+import os
+import re
+import unicodedata
+import warnings
+from collections import defaultdict
+from itertools import combinations
+from difflib import SequenceMatcher
+
+import pandas as pd
+
+PREFIX_LENGTH = 4  # Also index token prefixes, so 'Rodri' finds 'Rodrigo'
+MAX_NAME_TOKENS = 7  # Tokens past this are ignored when building variants
+MAX_VARIANT_TOKENS = 3  # Longest shortened name tried, e.g. 'Joao Moutinho'
+
+NAME_CORRECTIONS_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'name_corrections.csv'
+)
+CORRECTION_SOURCES = ['fpl', 'fapi']
+# Two names run together, e.g. 'Gabriel Fernando de JesusLucas Rodrigues'
+RUN_TOGETHER_NAMES = re.compile(r'[a-z]{3,}[A-Z][a-z]')
+
+
+def normalise_name(name):
+    """
+
+    Strip accents and dashes from a single name, e.g. 'Ødegaard' to 'Odegaard'
+
+    Characters without an ascii decomposition (such as 'Ł') are dropped.
+
+    :param name: Player name
+
+    :return name: Normalised name
+    """
+    return (unicodedata.normalize('NFKD', name)
+            .encode('ascii', errors='ignore')
+            .decode('utf-8')
+            .replace('-', ' '))
+
+
+class NameNormaliser:
+    """
+
+    Normalise name columns once per unique name, with a memo kept on disk
+
+    A fixture-level table repeats every name once per game, so each unique
+    name is normalised once and the results mapped back onto the rows.
+    Names seen on earlier runs or seasons are read from the memo file.
+
+    :param memo_file: Json file holding the memo, None to keep it in memory
+
+    """
+
+    def __init__(self, memo_file=None):
+        self.memo_file = memo_file
+        self.memo = {}
+        self.new_names = 0
+        if memo_file and os.path.exists(memo_file):
+            with open(memo_file, encoding='utf-8') as f:
+                self.memo = json.load(f)
+
+    def normalise(self, names):
+        """
+
+        Normalise a column of names
+
+        :param names: Pandas series of names, object or categorical
+
+        :return normalised: Pandas series of normalised names aligned with
+                            names
+        """
+        if isinstance(names.dtype, pd.CategoricalDtype):
+            unique_names = names.cat.categories
+        else:
+            unique_names = names.dropna().unique()
+
+        mapping = {}
+        for name in unique_names:
+            if name not in self.memo:
+                self.memo[name] = normalise_name(name)
+                self.new_names += 1
+            mapping[name] = self.memo[name]
+        return names.map(mapping)
+
+    def save(self):
+        """ Write the memo back to disk if any new names were normalised """
+        if not self.memo_file or not self.new_names:
+            return
+        tmp_file = self.memo_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.memo, f, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_file, self.memo_file)
+        self.new_names = 0
+
+
+def name_tokens(name):
+    """ Lower case tokens of a normalised name """
+    return str(name).lower().split()
+
+
+def index_keys(token):
+    """ Index keys for a token: the token itself and its prefix """
+    keys = {token}
+    if len(token) > PREFIX_LENGTH:
+        keys.add(token[:PREFIX_LENGTH])
+    return keys
+
+
+def name_similarity(query, candidate):
+    """
+
+    Similarity of two names between 0 and 1
+
+    Each query token is scored against its closest candidate token and the
+    scores are averaged, so a single name such as 'Willian' scores highly
+    against 'Willian Borges Da Silva'. The ratio of the full strings is used
+    instead when it is higher.
+
+    :param query: Name to match
+    :param candidate: Name to match against
+
+    :return score: Similarity score
+    """
+    query_tokens = name_tokens(query)
+    candidate_tokens = name_tokens(candidate)
+    if not query_tokens or not candidate_tokens:
+        return 0.0
+
+    token_score = sum(max(SequenceMatcher(None, q, c).ratio()
+                          for c in candidate_tokens)
+                      for q in query_tokens) / len(query_tokens)
+    full_score = SequenceMatcher(None,
+                                 ' '.join(query_tokens),
+                                 ' '.join(candidate_tokens)).ratio()
+    return max(token_score, full_score)
+
+
+class NameIndex:
+    """
+
+    Token inverted index over a set of normalised names
+
+    Built once, it turns candidate generation into a handful of dictionary
+    lookups instead of a str.contains scan over every row.
+
+    :param names: Normalised names to index
+    :param ids: Player ids aligned with names, defaults to their position
+
+    """
+
+    def __init__(self, names, ids=None):
+        self.names = list(names)
+        self.ids = list(ids) if ids is not None else list(range(len(names)))
+        self.index = defaultdict(set)
+        for i, name in enumerate(self.names):
+            for token in name_tokens(name):
+                for key in index_keys(token):
+                    self.index[key].add(i)
+
+    def candidates(self, name):
+        """ Positions of indexed names sharing a token or prefix with name """
+        found = set()
+        for token in name_tokens(name):
+            for key in index_keys(token):
+                found |= self.index.get(key, set())
+        return found
+
+    def match(self, name, top_n=3, min_score=0.6):
+        """
+
+        Ranked candidate matches for one name
+
+        :param name: Normalised name to match
+        :param top_n: Maximum number of candidates returned
+        :param min_score: Candidates scoring below this are dropped
+
+        :return matches: List of (candidate name, candidate id, score)
+                         tuples, best first
+        """
+        scored = []
+        for i in self.candidates(name):
+            score = name_similarity(name, self.names[i])
+            if score >= min_score:
+                scored.append((self.names[i], self.ids[i], score))
+        scored.sort(key=lambda match: (-match[2], match[0]))
+        return scored[:top_n]
+
+
+def match_names(query_names, index, top_n=3, min_score=0.6):
+    """
+
+    Build a ranked match table of names against an index
+
+    :param query_names: Iterable of normalised names to match
+    :param index: NameIndex of the names to match against
+    :param top_n: Maximum number of candidates per name
+    :param min_score: Candidates scoring below this are dropped
+
+    :return match_df: Pandas dataframe with query_name, candidate_name,
+                      candidate_id, score and rank (1 is best) columns
+    """
+    rows = []
+    for query_name in pd.unique(pd.Series(list(query_names), dtype=object)):
+        matches = index.match(query_name, top_n=top_n, min_score=min_score)
+        for rank, (name, candidate_id, score) in enumerate(matches, 1):
+            rows.append({'query_name': query_name,
+                         'candidate_name': name,
+                         'candidate_id': candidate_id,
+                         'score': score,
+                         'rank': rank})
+    return pd.DataFrame(rows, columns=['query_name',
+                                       'candidate_name',
+                                       'candidate_id',
+                                       'score',
+                                       'rank'])
+
+
+def name_variants(names,
+                  max_tokens=MAX_NAME_TOKENS,
+                  max_variant_tokens=MAX_VARIANT_TOKENS):
+    """
+
+    Shortened variants of full names, e.g. 'Lucas Moura' for
+    'Lucas Rodrigues Moura da Silva'
+
+    Each unique name is split into tokens once. Every ordered subsequence of
+    2 to max_variant_tokens tokens (other than the full name itself) is then
+    built for all names at once, one vectorised column operation per token
+    combination.
+
+    :param names: Iterable of normalised full names
+    :param max_tokens: Tokens past this position are ignored
+    :param max_variant_tokens: Longest variant built
+
+    :return variant_df: Pandas dataframe with name, variant and rule columns.
+                        The rule is 'first_plus_<i>' for the first name plus
+                        token i, otherwise 'subsequence'
+    """
+    unique_names = pd.Series(pd.unique(pd.Series(list(names), dtype=object)
+                                       .dropna()), dtype=object)
+    tokens = unique_names.str.split(expand=True)
+    tokens = tokens.reindex(columns=range(max_tokens))  # Token matrix
+    n_tokens = tokens.notna().sum(axis=1)
+
+    variant_dfs = []
+    for size in range(2, max_variant_tokens + 1):
+        for positions in combinations(range(max_tokens), size):
+            # Only names with every token present, and more tokens than the
+            # variant uses, so the full name itself is never a variant
+            has_tokens = (n_tokens > positions[-1]) & (n_tokens > size)
+            if not has_tokens.any():
+                continue
+            selected = tokens.loc[has_tokens]
+            if size == 2 and positions[0] == 0:
+                rule = 'first_plus_{}'.format(positions[1])
+            else:
+                rule = 'subsequence'
+            variant_dfs.append(pd.DataFrame({
+                'name': unique_names[has_tokens],
+                'variant': selected[positions[0]].str.cat(
+                    [selected[p] for p in positions[1:]], sep=' '
+                ),
+                'rule': rule,
+            }))
+
+    if not variant_dfs:
+        return pd.DataFrame(columns=['name', 'variant', 'rule'])
+    return pd.concat(variant_dfs, ignore_index=True)
+
+
+def match_variants(names, targets, **kwargs):
+    """
+
+    Find which shortened variants of names appear among the target names
+
+    All variants are resolved against a hash set of the targets in a single
+    isin pass.
+
+    :param names: Iterable of normalised full names, e.g. FPL names
+    :param targets: Iterable of normalised names to look for, e.g. football
+                    api names
+    :param kwargs: Passed on to name_variants
+
+    :return match_df: Rows of name_variants whose variant is a target name
+    """
+    variant_df = name_variants(names, **kwargs)
+    target_names = pd.Index(pd.unique(pd.Series(list(targets), dtype=object)))
+    return (variant_df
+            .loc[variant_df['variant'].isin(target_names)]
+            .reset_index(drop=True))
+
+
+def load_name_corrections(rules_file=NAME_CORRECTIONS_FILE):
+    """
+
+    Load and check the name correction rules, compiled into one mapping per
+    source
+
+    The rules file is a csv of source, from_name and to_name. Rules are
+    checked for unknown sources, blank or padded names, names that have not
+    been normalised, duplicated or conflicting from_names and chains (a
+    to_name that another rule renames again). Names that look like two names
+    run together only raise a warning.
+
+    :param rules_file: Path of the rules csv
+
+    :return corrections: Dictionary of source to a {from_name: to_name}
+                         dictionary
+    """
+    corrections = {source: {} for source in CORRECTION_SOURCES}
+    errors = []
+    with open(rules_file, encoding='utf-8', newline='') as f:
+        for line, rule in enumerate(csv.DictReader(f), 2):
+            source = rule['source']
+            from_name = rule['from_name']
+            to_name = rule['to_name']
+            where = '{} line {}'.format(os.path.basename(rules_file), line)
+
+            if source not in corrections:
+                errors.append('{}: unknown source {!r}'.format(where, source))
+                continue
+            for name in (from_name, to_name):
+                if not name or name != ' '.join(name.split()):
+                    errors.append('{}: blank or badly spaced name {!r}'
+                                  .format(where, name))
+                elif name != normalise_name(name):
+                    errors.append('{}: {!r} is not normalised'
+                                  .format(where, name))
+                elif RUN_TOGETHER_NAMES.search(name):
+                    warnings.warn('{}: {!r} looks like two names run together'
+                                  .format(where, name))
+            if from_name == to_name:
+                errors.append('{}: {!r} is renamed to itself'
+                              .format(where, from_name))
+            elif from_name in corrections[source]:
+                errors.append('{}: {!r} already has a rule'
+                              .format(where, from_name))
+            else:
+                corrections[source][from_name] = to_name
+
+    for source, mapping in corrections.items():
+        for from_name in set(mapping.values()) & set(mapping):
+            errors.append('{} rule for {!r} renames the result of another rule'
+                          .format(source, from_name))
+    if errors:
+        raise ValueError('Invalid name corrections:\n' + '\n'.join(errors))
+    return corrections
+
+
+def apply_name_corrections(names, mapping):
+    """
+
+    Apply a compiled correction mapping to a column of names in one pass
+
+    Categorical columns are corrected through their categories.
+
+    :param names: Pandas series of normalised names, object or categorical
+    :param mapping: Dictionary of from_name to to_name
+
+    :return names: Corrected pandas series
+    """
+    if isinstance(names.dtype, pd.CategoricalDtype):
+        categories = names.cat.categories.map(lambda n: mapping.get(n, n))
+        if categories.is_unique:
+            return names.cat.rename_categories(categories)
+        names = names.astype(object)
+    corrected = names.map(mapping)
+    return corrected.where(corrected.notna(), names)
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+
+Running the fetching and cleaning scripts as one pipeline
+
+The stages form a DAG. A stage's fingerprint is a hash of its parameters and
+of the content of its inputs (the outputs of the stages it depends on, plus
+any other files it reads). Fingerprints are kept in a state file together
+with a hash of what each stage wrote, and a stage only runs again when its
+fingerprint changes or its outputs no longer match. The fetch stages always
+run, as only the apis know whether anything is new, but a refresh that
+brings no new data stops there. Stages that do not depend on each other run
+in parallel.
+
+"""
+
+__author__ = 'Micah Cearns'
+__contact__ = 'micahcearns@gmail.com'
+__date__ = 'August 2020'
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from crosswalk import (CROSSWALK_DATASET, confirmed_matches, load_crosswalk,
+                       update_crosswalk)
+from metrics import shared_metrics
+from name_matching import (NAME_CORRECTIONS_FILE, NameNormaliser,
+                           load_name_corrections)
+from reconcile import prepare_players, unmatched_players
+from storage import compact_dtypes, dataset_path, read_dataset, write_dataset
+
+FIXTURE_SCRIPT = '01_Get_FAPI_Player_Fixture_Data'
+HISTORY_SCRIPT = '02_Get_FPL_History'
+CLEAN_SCRIPT = '03_Clean_Player_Data'
+
+STATE_FILE = '_pipeline_state.json'
+PIPELINE_MAX_WORKERS = 4
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Datasets written by the stages after the fetches
+SNAPSHOT_DATASETS = {'player_fixture': 'snapshot_player_fixture',
+                     'fpl_history': 'snapshot_fpl_history'}
+NORMALISED_DATASETS = {'player_fixture': 'normalised_player_fixture',
+                       'fpl_history': 'normalised_fpl_history'}
+MATCHES_DATASET = 'player_matches'
+UNMATCHED_DATASET = 'unmatched_players'
+UNMATCHED_FILE = 'Unmatched_players.csv'
+
+
+@dataclass
+class Stage:
+    """ One step of the pipeline, run as func(**params) """
+    name: str
+    func: callable
+    params: dict
+    outputs: list  # Files or directories the stage writes
+    deps: list = field(default_factory=list)
+    files: list = field(default_factory=list)  # Other files the stage reads
+    always_run: bool = False
+
+
+def load_script(name):
+    """ Import one of the numbered scripts, which are not valid identifiers """
+    return importlib.import_module(name)
+
+
+def file_hash(path):
+    """ Sha256 of a file's content """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_hash(paths):
+    """
+
+    Hash the content of files and directories
+
+    Directories are hashed over the data files below them, skipping hidden
+    staging directories and '_' bookkeeping files such as watermarks. Part
+    file names are random, so only their content counts.
+
+    :param paths: List of file or directory paths, missing ones are allowed
+
+    :return digest: Hex digest of everything in paths
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        if os.path.isfile(path):
+            file_hashes = [file_hash(path)]
+        elif os.path.isdir(path):
+            file_hashes = []
+            for directory, dirs, names in os.walk(path):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                file_hashes += [file_hash(os.path.join(directory, name))
+                                for name in names
+                                if not name.startswith(('.', '_'))]
+        else:
+            file_hashes = ['missing']
+        digest.update(json.dumps([path, sorted(file_hashes)]).encode())
+    return digest.hexdigest()
+
+
+def stage_fingerprint(stage, input_hashes):
+    """
+
+    Fingerprint of everything a stage's result depends on
+
+    :param stage: Stage to fingerprint
+    :param input_hashes: Dictionary of dependency name to output hash
+
+    :return fingerprint: Hex digest of the parameters and inputs
+    """
+    inputs = {'params': stage.params,
+              'deps': {dep: input_hashes[dep] for dep in stage.deps},
+              'files': {path: content_hash([path]) for path in stage.files}}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str)
+                          .encode()).hexdigest()
+
+
+def run_stage(stage, previous, input_hashes, force=False):
+    """
+
+    Run a stage unless its fingerprint and outputs match the previous run
+
+    :param stage: Stage to run
+    :param previous: State recorded for the stage by the previous run
+    :param input_hashes: Dictionary of dependency name to output hash
+    :param force: Run the stage whatever its fingerprint
+
+    :return ran: True if the stage ran, False if it was skipped
+    :return record: State to record for the stage
+    """
+    fingerprint = stage_fingerprint(stage, input_hashes)
+    if (not (force or stage.always_run)
+            and previous.get('fingerprint') == fingerprint
+            and previous.get('output_hash') == content_hash(stage.outputs)):
+        return False, previous
+
+    with shared_metrics().stage('pipeline_' + stage.name):
+        stage.func(**stage.params)
+    return True, {'fingerprint': fingerprint,
+                  'output_hash': content_hash(stage.outputs)}
+
+
+def load_state(state_file):
+    """ Stage fingerprints and output hashes from the previous run """
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def save_state(state, state_file):
+    """ Atomically write the pipeline state """
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, state_file)
+
+
+def run_pipeline(stages,
+                 state_file,
+                 max_workers=PIPELINE_MAX_WORKERS,
+                 force=()):
+    """
+
+    Run a DAG of stages, skipping those whose inputs have not changed
+
+    A stage is started as soon as every stage it depends on has finished.
+    The state is saved after each stage, so a failed run keeps the work
+    that was done before the failure.
+
+    :param stages: List of Stage
+    :param state_file: Json file holding the state between runs
+    :param max_workers: Number of stages run at the same time
+    :param force: Names of stages to run whatever their fingerprint
+
+    :return results: Dictionary of stage name to 'ran' or 'skipped'
+    """
+    state = load_state(state_file)
+    pending = {stage.name: stage for stage in stages}
+    running = {}
+    output_hashes = {}
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if all(dep in output_hashes for dep in stage.deps):
+                    future = pool.submit(run_stage,
+                                         stage,
+                                         state.get(name, {}),
+                                         dict(output_hashes),
+                                         force=name in force)
+                    running[future] = pending.pop(name)
+            if not running:
+                raise ValueError('Stages {} depend on missing stages'
+                                 .format(sorted(pending)))
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                ran, record = future.result()
+                state[stage.name] = record
+                output_hashes[stage.name] = record['output_hash']
+                results[stage.name] = 'ran' if ran else 'skipped'
+                save_state(state, state_file)
+
+    return results
+
+
+def fetch_fixtures(root, league, country, season, partition_league):
+    """ Add newly finished fixtures to the player fixture dataset in root """
+    fixtures = load_script(FIXTURE_SCRIPT)
+    fixtures.OUTPUT_PATH = root
+    headers = fixtures.connect_to_api()
+    league_id = fixtures.get_league_id(headers, league, country, season)
+    fixtures.sync_player_data(league_id,
+                              headers,
+                              league=partition_league,
+                              season=season)
+
+
+def fetch_history(root):
+    """ Fetch a bootstrap-static snapshot and save the history to root """
+    history = load_script(HISTORY_SCRIPT)
+    history.OUTPUT_PATH = history.DK_OUTPUT_PATH = root
+    history.load_bootstrap_snapshot(refresh=True)
+    history.fetch_and_save_history()
+
+
+def snapshot(root, league, fapi_season, fpl_league, fpl_season):
+    """
+
+    Save compacted copies of just the rows and columns reconciled
+
+    Changes to other columns of the fetched datasets leave the snapshot, and
+    so everything after it, unchanged.
+    """
+    cleaning = load_script(CLEAN_SCRIPT)
+    sources = [
+        ('player_fixture', cleaning.PLAYER_COLUMNS, league, fapi_season),
+        ('fpl_history', cleaning.FPL_COLUMNS, fpl_league, fpl_season),
+    ]
+    for dataset, columns, dataset_league, season in sources:
+        df = read_dataset(root,
+                          dataset,
+                          columns=columns,
+                          league=dataset_league,
+                          season=season)
+        write_dataset(compact_dtypes(df, dataset),
+                      root,
+                      SNAPSHOT_DATASETS[dataset])
+
+
+def normalize(root, memo_file):
+    """ Parse and correct the snapshot names """
+    normaliser = NameNormaliser(memo_file)
+    player_df, fpl_df = prepare_players(
+        read_dataset(root, SNAPSHOT_DATASETS['player_fixture']),
+        read_dataset(root, SNAPSHOT_DATASETS['fpl_history']),
+        normaliser=normaliser,
+        corrections=load_name_corrections()
+    )
+    normaliser.save()
+    write_dataset(player_df, root, NORMALISED_DATASETS['player_fixture'])
+    write_dataset(fpl_df, root, NORMALISED_DATASETS['fpl_history'])
+
+
+def reconcile_players(root):
+    """ Match the normalised players and save the matches and the rest """
+    player_df = read_dataset(root, NORMALISED_DATASETS['player_fixture'])
+    fpl_df = read_dataset(root, NORMALISED_DATASETS['fpl_history'])
+    matched = confirmed_matches(fpl_df, player_df)
+    write_dataset(matched, root, MATCHES_DATASET)
+    write_dataset(unmatched_players(player_df, fpl_df, matched),
+                  root,
+                  UNMATCHED_DATASET)
+
+
+def export(root):
+    """ Add the matches to the crosswalk and list the rest for checking """
+    update_crosswalk(root,
+                     load_crosswalk(root),
+                     read_dataset(root, MATCHES_DATASET))
+    (read_dataset(root, UNMATCHED_DATASET)
+     .sort_values(by=['source', 'parsed_full_name'])
+     .to_csv(os.path.join(root, UNMATCHED_FILE), index=False))
+
+
+def build_stages(root, league, country, fapi_season, fpl_season):
+    """
+
+    The pipeline DAG for one league season
+
+    :param root: Output directory holding every dataset
+    :param league: Football api league name, e.g. 'Premier League'
+    :param country: Country of the league, e.g. 'England'
+    :param fapi_season: Football api season, e.g. 2019
+    :param fpl_season: FPL season name, e.g. '2019/20'
+
+    :return stages: List of Stage
+    """
+    partition_league = '{} {}'.format(country, league)
+    fpl_league = load_script(HISTORY_SCRIPT).FPL_LEAGUE
+    cleaning = load_script(CLEAN_SCRIPT)
+
+    def paths(*datasets):
+        return [dataset_path(root, dataset) for dataset in datasets]
+
+    return [
+        Stage('fetch-fixtures',
+              fetch_fixtures,
+              params={'root': root,
+                      'league': league,
+                      'country': country,
+                      'season': fapi_season,
+                      'partition_league': partition_league},
+              outputs=[dataset_path(root,
+                                    'player_fixture',
+                                    partition_league,
+                                    fapi_season)],
+              always_run=True),
+        Stage('fetch-history',
+              fetch_history,
+              params={'root': root},
+              outputs=[dataset_path(root,
+                                    'fpl_history',
+                                    fpl_league,
+                                    fpl_season)],
+              always_run=True),
+        Stage('snapshot',
+              snapshot,
+              params={'root': root,
+                      'league': partition_league,
+                      'fapi_season': fapi_season,
+                      'fpl_league': fpl_league,
+                      'fpl_season': fpl_season},
+              outputs=paths(*SNAPSHOT_DATASETS.values()),
+              deps=['fetch-fixtures', 'fetch-history']),
+        Stage('normalize',
+              normalize,
+              params={'root': root,
+                      'memo_file': os.path.join(root,
+                                                cleaning.NAME_MEMO_FILE)},
+              outputs=paths(*NORMALISED_DATASETS.values()),
+              deps=['snapshot'],
+              files=[NAME_CORRECTIONS_FILE]),
+        Stage('reconcile',
+              reconcile_players,
+              params={'root': root},
+              outputs=paths(MATCHES_DATASET, UNMATCHED_DATASET),
+              deps=['normalize']),
+        Stage('export',
+              export,
+              params={'root': root},
+              outputs=(paths(CROSSWALK_DATASET)
+                       + [os.path.join(root, UNMATCHED_FILE)]),
+              deps=['reconcile']),
+    ]
+
+
+if __name__ == '__main__':
+    cleaning = load_script(CLEAN_SCRIPT)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--root',
+                        default=cleaning.OUTPUT_PATH,
+                        help='Output directory the scripts write to')
+    parser.add_argument('--league', default='Premier League')
+    parser.add_argument('--country', default='England')
+    parser.add_argument('--fapi-season',
+                        type=int,
+                        default=cleaning.FAPI_SEASON)
+    parser.add_argument('--fpl-season', default=cleaning.FPL_SEASON)
+    parser.add_argument('--force',
+                        nargs='*',
+                        default=[],
+                        help='Stages to run even if their inputs have not '
+                             'changed')
+    args = parser.parse_args()
+
+    stages = build_stages(args.root,
+                          args.league,
+                          args.country,
+                          args.fapi_season,
+                          args.fpl_season)
+    try:
+        results = run_pipeline(stages,
+                               os.path.join(args.root, STATE_FILE),
+                               force=set(args.force))
+    finally:
+        shared_metrics().save(args.root, 'pipeline')
+    for stage in stages:
+        print('{:<15} {}'.format(stage.name, results[stage.name]))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+
+Classifying FPL player news into a player status
+
+"""
+
+__author__ = 'Micah Cearns'
+__contact__ = 'micahcearns@gmail.com'
+__date__ = 'August 2020'
+
+import re
+
+import pandas as pd
+
+# Checked in order, the first matching pattern gives the status. News that
+# matches none of them (including no news at all) means available.
+NEWS_PATTERNS = [
+    ('transferred', re.compile('Joined'
+                               '|Contract terminated'
+                               '|Loan deal ended'
+                               '|Returned')),
+    ('doubtful', re.compile(r'\d+% chance of playing', re.IGNORECASE)),
+    ('injured', re.compile('injur'  # Injured or suspended, out for now
+                           '|knock'
+                           r'|\bill(ness)?\b'
+                           '|suspended'
+                           '|expected back'
+                           '|unknown return date', re.IGNORECASE)),
+]
+PLAYER_STATUSES = pd.CategoricalDtype([status for status, _ in NEWS_PATTERNS]
+                                      + ['available'])
+
+
+def news_status(news):
+    """
+
+    Status of a single news string
+
+    :param news: FPL player news
+
+    :return status: One of the PLAYER_STATUSES categories
+    """
+    if isinstance(news, str):
+        for status, pattern in NEWS_PATTERNS:
+            if pattern.search(news):
+                return status
+    return 'available'
+
+
+def classify_news(news):
+    """
+
+    Classify a column of FPL player news
+
+    News strings repeat across players (and are often empty), so each unique
+    string is classified once and the statuses mapped back onto the rows.
+
+    :param news: Pandas series of player news, object or categorical
+
+    :return status: Categorical pandas series of PLAYER_STATUSES aligned with
+                    news
+    """
+    unique_news = pd.unique(news.astype(object))
+    statuses = {item: news_status(item) for item in unique_news}
+    return news.astype(object).map(statuses).astype(PLAYER_STATUSES)
+
+
+def add_player_status(fpl_df):
+    """
+
+    Tag each FPL player with a player_status column from their news
+
+    :param fpl_df: FPL dataframe with a player_news column
+
+    :return fpl_df: fpl_df with a categorical player_status column
+    """
+    return fpl_df.assign(player_status=classify_news(fpl_df['player_news']))
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+
+Reconciling football api players with FPL players
+
+Every function works on in-memory dataframes and returns new ones, without
+printing or touching the working directory, so a long-lived process can keep
+the data loaded and rerun the reconciliation whenever either side changes.
+
+"""
+
+__author__ = 'Micah Cearns'
+__contact__ = 'micahcearns@gmail.com'
+__date__ = 'August 2020'
+
+import pandas as pd
+
+from crosswalk import confirmed_matches, split_known_players
+from name_matching import (NameIndex, NameNormaliser, apply_name_corrections,
+                           load_name_corrections, match_names, match_variants)
+from player_news import add_player_status
+
+UNMATCHED_COLUMNS = ['source', 'player_id', 'name', 'parsed_full_name']
+
+
+def parse_names(df, name_column, normaliser):
+    """
+
+    Add a parsed_full_name column of normalised names
+
+    :param df: Pandas dataframe with a name column
+    :param name_column: Column holding the names
+    :param normaliser: NameNormaliser used (and updated) for the names
+
+    :return df: Copy of df with a parsed_full_name column
+    """
+    return df.assign(parsed_full_name=normaliser.normalise(df[name_column]))
+
+
+def active_fpl_players(fpl_df):
+    """
+
+    FPL players that have played and have not left the league
+
+    :param fpl_df: FPL dataframe with minutes and player_news columns
+
+    :return fpl_df: The remaining rows, with a player_status column
+    """
+    fpl_df = add_player_status(fpl_df.loc[fpl_df['minutes'] != 0])
+    return fpl_df.loc[fpl_df['player_status'] != 'transferred']
+
+
+def prepare_players(player_df, fpl_df, normaliser=None, corrections=None):
+    """
+
+    Parse and correct the names on both sides ready for matching
+
+    :param player_df: Football api dataframe with a player_name column
+    :param fpl_df: FPL dataframe with full_name, minutes and player_news
+                   columns
+    :param normaliser: NameNormaliser to reuse between calls, a new in-memory
+                       one by default
+    :param corrections: Compiled rules from load_name_corrections, read from
+                        the rules file by default
+
+    :return player_df: Football api dataframe with parsed_full_name
+    :return fpl_df: Active FPL players with parsed_full_name and player_status
+    """
+    if normaliser is None:
+        normaliser = NameNormaliser()
+    if corrections is None:
+        corrections = load_name_corrections()
+
+    player_df = parse_names(player_df, 'player_name', normaliser)
+    fpl_df = parse_names(active_fpl_players(fpl_df), 'full_name', normaliser)
+    player_df['parsed_full_name'] = apply_name_corrections(
+        player_df['parsed_full_name'], corrections['fapi']
+    )
+    fpl_df['parsed_full_name'] = apply_name_corrections(
+        fpl_df['parsed_full_name'], corrections['fpl']
+    )
+    return player_df, fpl_df
+
+
+def unmatched_players(player_df, fpl_df, matched):
+    """
+
+    Players on either side that are not in matched
+
+    :param player_df: Football api dataframe with player_id, player_name and
+                      parsed_full_name columns
+    :param fpl_df: FPL dataframe with player_id, full_name and
+                   parsed_full_name columns
+    :param matched: Matches from confirmed_matches
+
+    :return unmatched: Pandas dataframe of UNMATCHED_COLUMNS, one row per
+                       player, where source is 'fpl' or 'fapi'
+    """
+    sides = [('fpl', fpl_df, 'full_name', matched['fpl_player_id']),
+             ('fapi', player_df, 'player_name', matched['fapi_player_id'])]
+    unmatched_dfs = []
+    for source, df, name_column, matched_ids in sides:
+        unmatched_dfs.append(
+            df.loc[~df['player_id'].isin(matched_ids),
+                   ['player_id', name_column, 'parsed_full_name']]
+            .drop_duplicates('player_id')
+            .rename(columns={name_column: 'name'})
+            .astype({'name': object, 'parsed_full_name': object})
+            .assign(source=source)
+        )
+    return (pd.concat(unmatched_dfs, ignore_index=True)
+            .reindex(columns=UNMATCHED_COLUMNS))
+
+
+def reconcile(player_df,
+              fpl_df,
+              crosswalk=None,
+              normaliser=None,
+              corrections=None):
+    """
+
+    Match football api players to FPL players
+
+    Players whose parsed names agree one to one after the name corrections
+    are matched. Players already in the crosswalk are left out.
+
+    :param player_df: Football api dataframe with player_id and player_name
+                      columns
+    :param fpl_df: FPL dataframe with player_id, full_name, minutes and
+                   player_news columns
+    :param crosswalk: Crosswalk from load_crosswalk, None to match everyone
+    :param normaliser: NameNormaliser to reuse between calls
+    :param corrections: Compiled rules from load_name_corrections
+
+    :return matched: Pandas dataframe of CROSSWALK_COLUMNS for the new matches
+    :return unmatched: Pandas dataframe of UNMATCHED_COLUMNS
+    """
+    if crosswalk is not None:
+        fpl_df, player_df = split_known_players(crosswalk, fpl_df, player_df)
+    player_df, fpl_df = prepare_players(player_df,
+                                        fpl_df,
+                                        normaliser=normaliser,
+                                        corrections=corrections)
+    matched = confirmed_matches(fpl_df, player_df)
+    return matched, unmatched_players(player_df, fpl_df, matched)
+
+
+def combination_candidates(player_df, fpl_df):
+    """
+
+    FPL players whose name shortens to a football api name
+
+    The FPL data often uses full names, including middle names, whereas the
+    football api does not. Shortened variants other than the first two names
+    are looked up in the football api names, and the ones found are matched
+    back against the FPL names.
+
+    :param player_df: Football api dataframe with parsed_full_name
+    :param fpl_df: FPL dataframe with player_id and parsed_full_name
+
+    :return match_df: Match table from match_names, football api names as
+                      query_name
+    """
+    combination_matches = match_variants(fpl_df['parsed_full_name'],
+                                         player_df['parsed_full_name'])
+    combination_matches = (combination_matches
+                           .loc[combination_matches['rule'] != 'first_plus_1'])
+    fpl_name_index = NameIndex(fpl_df['parsed_full_name'],
+                               ids=fpl_df['player_id'])
+    return match_names(combination_matches['variant'].drop_duplicates(),
+                       fpl_name_index)
+
+
+def single_name_candidates(player_df, fpl_df):
+    """
+
+    FPL candidates for unmatched football api players known by one name
+
+    :param player_df: Football api dataframe with parsed_full_name
+    :param fpl_df: FPL dataframe with player_id and parsed_full_name
+
+    :return match_df: Match table from match_names, football api names as
+                      query_name
+    """
+    unmatched_names = pd.Series(
+        player_df.loc[~player_df['parsed_full_name']
+                      .isin(fpl_df['parsed_full_name']), 'parsed_full_name']
+        .astype(object)
+        .dropna()
+        .unique()
+    )
+    single_names = sorted(unmatched_names.loc[unmatched_names.str.split()
+                                              .str.len() == 1])
+    fpl_name_index = NameIndex(fpl_df['parsed_full_name'],
+                               ids=fpl_df['player_id'])
+    return match_names(single_names, fpl_name_index)
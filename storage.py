@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+
+Columnar Parquet storage shared by the fetching and cleaning scripts
+
+Datasets live under <root>/<dataset>/league=<league>/season=<season>/ as
+compressed Parquet part files, so each stage can read just the partitions and
+columns it needs.
+
+"""
+
+__author__ = 'Micah Cearns'
+__contact__ = 'micahcearns@gmail.com'
+__date__ = 'August 2020'
+
+import os
+import shutil
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+COMPRESSION = 'zstd'
+
+# In-memory dtypes applied by compact_dtypes. Repeated strings become
+# categoricals and numbers sent as strings are parsed.
+CATEGORICAL_COLUMNS = {
+    'player_fixture': ['player_name', 'team_name', 'position'],
+    'player_season': ['team_name', 'position'],
+    'fpl_history': ['position', 'season_name', 'player_news'],
+}
+NUMERIC_STRING_COLUMNS = {
+    'player_fixture': ['rating'],  # '–' when a player was not rated
+}
+BOOLEAN_STRING_COLUMNS = {
+    'player_fixture': ['captain', 'substitute'],  # 'True' or 'False'
+}
+
+# Categorical columns are stored dictionary encoded, always with the same
+# index type whatever number of categories a batch has
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+# Explicit types of every column we write, so all partitions of a dataset
+# share one schema. Columns the api adds later are written with the type
+# pyarrow infers for them, which conform_parts then evens out across the
+# part files of a partition.
+SCHEMAS = {
+    'player_fixture': pa.schema([
+        ('event_id', pa.int32()),
+        ('updateAt', pa.int64()),
+        ('player_id', pa.int32()),
+        ('player_name', CATEGORY),
+        ('team_id', pa.int32()),
+        ('team_name', CATEGORY),
+        ('number', pa.int16()),
+        ('position', CATEGORY),
+        ('rating', pa.float32()),
+        ('minutes_played', pa.int16()),
+        ('captain', pa.bool_()),
+        ('substitute', pa.bool_()),
+        ('offsides', pa.int16()),
+        ('shots.total', pa.int16()),
+        ('shots.on', pa.int16()),
+        ('goals.total', pa.int16()),
+        ('goals.conceded', pa.int16()),
+        ('goals.assists', pa.int16()),
+        ('goals.saves', pa.int16()),
+        ('passes.total', pa.int16()),
+        ('passes.key', pa.int16()),
+        ('passes.accuracy', pa.int16()),
+        ('tackles.total', pa.int16()),
+        ('tackles.blocks', pa.int16()),
+        ('tackles.interceptions', pa.int16()),
+        ('duels.total', pa.int16()),
+        ('duels.won', pa.int16()),
+        ('dribbles.attempts', pa.int16()),
+        ('dribbles.success', pa.int16()),
+        ('dribbles.past', pa.int16()),
+        ('fouls.drawn', pa.int16()),
+        ('fouls.committed', pa.int16()),
+        ('cards.yellow', pa.int8()),
+        ('cards.red', pa.int8()),
+        ('penalty.won', pa.int8()),
+        ('penalty.commited', pa.int8()),  # Spelt this way by the api
+        ('penalty.success', pa.int8()),
+        ('penalty.missed', pa.int8()),
+        ('penalty.saved', pa.int8()),
+    ]),
+    'player_season': pa.schema([
+        ('player_id', pa.int32()),
+        ('player_name', pa.string()),
+        ('team_id', pa.int32()),
+        ('team_name', CATEGORY),
+        ('position', CATEGORY),
+        ('appearances', pa.int16()),
+        ('minutes_played', pa.int32()),
+        ('goals.total', pa.int16()),
+        ('goals.assists', pa.int16()),
+        ('goals.saves', pa.int16()),
+    ]),
+    'fpl_history': pa.schema([
+        ('player_id', pa.int64()),
+        ('full_name', pa.string()),
+        ('team_id', pa.int64()),
+        ('position', CATEGORY),
+        ('start_cost', pa.int16()),
+        ('end_cost', pa.int16()),
+        ('now_cost', pa.int16()),
+        ('total_points', pa.int16()),
+        ('season_name', CATEGORY),
+        ('minutes', pa.int32()),
+        ('bonus', pa.int16()),
+        ('bonus_points', pa.int16()),
+        ('goals_scored', pa.int16()),
+        ('assists', pa.int16()),
+        ('selected_by', pa.float32()),
+        ('goals_conceded', pa.int16()),
+        ('clean_sheets', pa.int16()),
+        ('yellow_cards', pa.int8()),
+        ('red_cards', pa.int8()),
+        ('penalties_missed', pa.int8()),
+        ('saves', pa.int16()),
+        ('penalties_saved', pa.int8()),
+        ('player_form', pa.float32()),
+        ('value_to_form_ratio', pa.float32()),
+        ('player_news', CATEGORY),
+        ('chance_of_playing_next_round', pa.int8()),
+    ]),
+    'positions': pa.schema([
+        ('id', pa.int64()),
+        ('singular_name', pa.string()),
+        ('singular_name_short', pa.string()),
+        ('plural_name', pa.string()),
+        ('squad_select', pa.int8()),
+    ]),
+    'player_crosswalk': pa.schema([
+        ('fpl_player_id', pa.int64()),
+        ('fapi_player_id', pa.int64()),
+        ('fpl_name', pa.string()),
+        ('fapi_name', pa.string()),
+        ('method', pa.string()),
+    ]),
+    'leagues': pa.schema([
+        ('league_id', pa.int32()),
+        ('name', pa.string()),
+        ('country', pa.string()),
+        ('season', pa.int16()),
+        ('type', pa.string()),
+        ('country_code', pa.string()),
+        ('season_start', pa.string()),
+        ('season_end', pa.string()),
+        ('is_current', pa.int8()),
+    ]),
+}
+
+PARTITIONING = ds.partitioning(pa.schema([('league', pa.string()),
+                                          ('season', pa.string())]),
+                               flavor='hive')
+
+
+def partition_value(value):
+    """ Make a league or season safe to use as a directory name """
+    return str(value).replace('/', '-').replace(' ', '_')
+
+
+def dataset_path(root, dataset, league=None, season=None):
+    """
+
+    Directory holding a dataset, or one league/season partition of it
+
+    :param root: Output directory holding every dataset
+    :param dataset: Dataset name, e.g. 'player_fixture'
+    :param league: League partition, None for unpartitioned datasets
+    :param season: Season partition, None for unpartitioned datasets
+
+    :return path: Directory of the dataset or partition
+    """
+    path = os.path.join(root, dataset)
+    if league is None and season is None:
+        return path
+    return os.path.join(path,
+                        'league=' + partition_value(league),
+                        'season=' + partition_value(season))
+
+
+def to_table(df, dataset):
+    """
+
+    Convert a dataframe to an arrow table, casting columns to their schema
+
+    :param df: Pandas dataframe to convert
+    :param dataset: Dataset name used to look up SCHEMAS
+
+    :return table: Arrow table
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    schema = SCHEMAS.get(dataset, pa.schema([]))
+    for i, name in enumerate(table.column_names):
+        if name not in schema.names:
+            continue
+        field = schema.field(name)
+        table = table.set_column(i, field, table.column(i).cast(field.type))
+    return table
+
+
+def write_part(df, path, dataset):
+    """
+
+    Write a dataframe as one compressed part file in path
+
+    :param df: Pandas dataframe to write
+    :param path: Partition directory
+    :param dataset: Dataset name used to look up SCHEMAS
+
+    :return part_file: Path of the written part file
+    """
+    os.makedirs(path, exist_ok=True)
+    part_file = os.path.join(path, 'part-{}.parquet'.format(uuid.uuid4().hex))
+    pq.write_table(to_table(df, dataset), part_file, compression=COMPRESSION)
+    return part_file
+
+
+def write_dataset(df, root, dataset, league=None, season=None):
+    """
+
+    Replace a dataset (or one of its partitions) with df
+
+    The new data is written next to the old first and then swapped in, so
+    readers never see a half written partition.
+
+    :param df: Pandas dataframe to write
+    :param root: Output directory holding every dataset
+    :param dataset: Dataset name, e.g. 'fpl_history'
+    :param league: League partition, None for unpartitioned datasets
+    :param season: Season partition, None for unpartitioned datasets
+
+    :return path: Directory the data was written to
+    """
+    path = dataset_path(root, dataset, league, season)
+    staging = staging_path(path)
+    shutil.rmtree(staging, ignore_errors=True)
+    write_part(df, staging, dataset)
+    replace_partition(staging, path)
+    return path
+
+
+def staging_path(path):
+    """ Hidden sibling of path that readers skip while it is being written """
+    return os.path.join(os.path.dirname(path),
+                        '.' + os.path.basename(path) + '.tmp')
+
+
+def replace_partition(staging, path):
+    """ Swap a fully written staging directory in for path """
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(staging, path)
+
+
+def append_partition(staging, path):
+    """ Move every part file in a staging directory into path """
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(staging):
+        os.replace(os.path.join(staging, name), os.path.join(path, name))
+    os.rmdir(staging)
+
+
+def part_files(path):
+    """ Part files of a partition directory """
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if name.endswith('.parquet'))
+
+
+def partition_schema(path):
+    """ Common schema of the part files of a partition directory """
+    return common_schema(pq.read_schema(part_file)
+                         for part_file in part_files(path))
+
+
+def common_type(a, b):
+    """
+
+    Narrowest arrow type that holds the values of both a and b
+
+    :param a: Arrow data type
+    :param b: Arrow data type
+
+    :return type: Arrow data type both a and b can be cast to
+    """
+    if a == b or pa.types.is_null(b):
+        return a
+    if pa.types.is_null(a):
+        return b
+    if pa.types.is_dictionary(a) and pa.types.is_dictionary(b):
+        return pa.dictionary(pa.int32(),
+                             common_type(a.value_type, b.value_type))
+    if pa.types.is_dictionary(a):
+        return common_type(a.value_type, b)
+    if pa.types.is_dictionary(b):
+        return common_type(a, b.value_type)
+    if pa.types.is_integer(a) and pa.types.is_integer(b):
+        if pa.types.is_signed_integer(a) != pa.types.is_signed_integer(b):
+            return pa.int64()
+        return a if a.bit_width > b.bit_width else b
+    if pa.types.is_floating(a) and pa.types.is_floating(b):
+        return a if a.bit_width > b.bit_width else b
+    if ((pa.types.is_integer(a) or pa.types.is_floating(a))
+            and (pa.types.is_integer(b) or pa.types.is_floating(b))):
+        return pa.float64()
+    if pa.types.is_large_string(a) or pa.types.is_large_string(b):
+        return pa.large_string()
+    return pa.string()
+
+
+def common_schema(schemas):
+    """ Schema with every column of schemas, each in its common_type """
+    types = {}
+    for schema in schemas:
+        for field in schema:
+            types[field.name] = (common_type(types[field.name], field.type)
+                                 if field.name in types else field.type)
+    return pa.schema(list(types.items()))
+
+
+def conform_parts(path, schema=None):
+    """
+
+    Rewrite the part files in path that differ from their common schema
+
+    A dataset written batch by batch gets, in every part file, the types
+    pyarrow infers for that batch's rows, e.g. int8 in one part and int16 or
+    null in the next, which the dataset reader cannot combine. Parts that
+    differ are cast to the common schema of all of them, one at a time, with
+    the columns a part lacks filled with nulls.
+
+    :param path: Directory of part files
+    :param schema: Schema the parts must also fit, e.g. that of the partition
+                   they are about to be appended to
+
+    :return schema: Common schema of the parts
+    """
+    files = part_files(path)
+    part_schemas = [pq.read_schema(part_file) for part_file in files]
+    common = common_schema(part_schemas + ([schema] if schema else []))
+
+    for part_file, part_schema in zip(files, part_schemas):
+        if part_schema.remove_metadata().equals(common):
+            continue
+        table = pq.read_table(part_file)
+        columns = [table.column(field.name).cast(field.type)
+                   if field.name in part_schema.names
+                   else pa.nulls(table.num_rows, field.type)
+                   for field in common]
+        conformed_file = part_file + '.tmp'
+        pq.write_table(pa.Table.from_arrays(columns, schema=common),
+                       conformed_file,
+                       compression=COMPRESSION)
+        os.replace(conformed_file, part_file)
+    return common
+
+
+def read_dataset(root, dataset, columns=None, league=None, season=None):
+    """
+
+    Read a dataset, loading only the columns and partitions asked for
+
+    :param root: Output directory holding every dataset
+    :param dataset: Dataset name, e.g. 'player_fixture'
+    :param columns: Columns to load, defaults to all of them
+    :param league: Only load this league's partitions
+    :param season: Only load this season's partitions
+
+    :return df: Pandas dataframe of the selected data
+    """
+    path = dataset_path(root, dataset)
+    partitioned = any(name.startswith('league=') for name in os.listdir(path))
+    data = ds.dataset(path,
+                      format='parquet',
+                      partitioning=PARTITIONING if partitioned else None)
+
+    row_filter = None
+    for key, value in (('league', league), ('season', season)):
+        if value is not None:
+            condition = ds.field(key) == partition_value(value)
+            row_filter = (condition if row_filter is None
+                          else row_filter & condition)
+
+    return data.to_table(columns=columns, filter=row_filter).to_pandas()
+
+
+def downcast_numeric(series):
+    """
+
+    Downcast a numeric series to the smallest dtype that holds its values
+
+    Whole-number floats (typically integers with missing values) become
+    nullable integers rather than float64.
+
+    :param series: Numeric pandas series
+
+    :return series: Downcast series
+    """
+    if pd.api.types.is_bool_dtype(series):
+        return series
+    if pd.api.types.is_float_dtype(series):
+        values = series.dropna()
+        if not (values % 1 == 0).all():
+            return pd.to_numeric(series, downcast='float')
+        series = series.astype('Int64')
+    return pd.to_numeric(series, downcast='integer')
+
+
+def compact_dtypes(df, dataset):
+    """
+
+    Give a dataframe memory-compact dtypes
+
+    Repeated strings listed in CATEGORICAL_COLUMNS become categoricals,
+    numbers and booleans sent as strings are parsed and every numeric column
+    is downcast to the smallest width that holds its values.
+
+    :param df: Pandas dataframe to compact
+    :param dataset: Dataset name used to look up the column lists
+
+    :return df: New dataframe with compact dtypes
+    """
+    categorical = CATEGORICAL_COLUMNS.get(dataset, [])
+    numeric_strings = NUMERIC_STRING_COLUMNS.get(dataset, [])
+    boolean_strings = BOOLEAN_STRING_COLUMNS.get(dataset, [])
+
+    columns = {}
+    for name, series in df.items():
+        if name in categorical:
+            series = series.astype('category')
+        elif name in boolean_strings:
+            series = (series.astype(str).str.lower()
+                      .map({'true': True, 'false': False})
+                      .astype('boolean'))
+        elif name in numeric_strings:
+            series = pd.to_numeric(series, errors='coerce').astype('float32')
+        elif pd.api.types.is_numeric_dtype(series):
+            series = downcast_numeric(series)
+        columns[name] = series
+    return pd.DataFrame(columns, index=df.index)
+
+
+def memory_report(before, after):
+    """
+
+    Per-column memory use of a dataframe before and after compact_dtypes
+
+    :param before: Original pandas dataframe
+    :param after: Compacted pandas dataframe
+
+    :return report: Pandas dataframe of dtypes and bytes per column, with a
+                    final 'total' row
+    """
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'dtype_after': after.dtypes.astype(str),
+        'bytes_before': before.memory_usage(index=False, deep=True),
+        'bytes_after': after.memory_usage(index=False, deep=True),
+    })
+    report.loc['total', ['bytes_before', 'bytes_after']] = (
+        report[['bytes_before', 'bytes_after']].sum()
+    )
+    report['saved_pct'] = 100 * (1 - report['bytes_after']
+                                 / report['bytes_before'])
+    return report
+
+
+def sum_memory_reports(reports):
+    """
+
+    Add up memory_report tables, e.g. one per batch of a dataset
+
+    :param reports: List of memory_report dataframes
+
+    :return report: Pandas dataframe of the summed bytes per column, with the
+                    dtypes of the latest report and a final 'total' row
+    """
+    columns = pd.concat([report.drop(index='total') for report in reports])
+    grouped = columns.groupby(level=0, sort=False)
+    report = grouped[['dtype_before', 'dtype_after']].last().join(
+        grouped[['bytes_before', 'bytes_after']].sum()
+    )
+    report.loc['total', ['bytes_before', 'bytes_after']] = (
+        report[['bytes_before', 'bytes_after']].sum()
+    )
+    report['saved_pct'] = 100 * (1 - report['bytes_after']
+                                 / report['bytes_before'])
+    return report